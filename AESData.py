@@ -1,38 +1,172 @@
 import json
-import nltk.data
-import pandas as pd
-import statistics
+import mmap
+import numpy as np
 import os
 import re
+from collections import OrderedDict
+from AESProfiler import profiler
+
+class AESEssay:
+    """An essay that is not part of a dataset (e.g. a newly submitted essay).
+    It can be used instead of an essay id in AESLinguisticFeatures and AESEmbeddings. Tokens calculated for the essay are kept in its cache."""
+
+    def __init__(self, text: str, prompt: int = -1):
+        """Constructor. Requires the essay's text. The prompt is optional (-1 if unknown)"""
+        self.text = text
+        self.prompt = prompt
+        self.cache = {}
 
 class AESData:
     """Abstraction for AES datasets."""
     
-    def __init__(self, dataset_path: str, printer_format: str ="github"):
-        """Dataset can be loaded using a special JSON card defined as `dataset_path`. `printer_format` describes the input format for printers."""
+    def __init__(self, dataset_path: str, printer_format: str ="github", lazy: bool = False, essay_cache_size: int = 4096):
+        """Dataset can be loaded using a special JSON card defined as `dataset_path`. `printer_format` describes the input format for printers.
+        If `lazy` is True, the dataset file is memory-mapped and essays are decoded only when requested. 
+        The row offsets index is built once and saved next to the JSON card.
+        `essay_cache_size` limits the number of cleaned essays kept in memory (0 disables the cache, -1 makes it unbounded)."""
+        self.dataset_path = dataset_path
         self.printer_format = printer_format
+        self.lazy = lazy
+        self.essay_cache_size = essay_cache_size
+        self.essay_cache = OrderedDict()
         # Load dataset card
         self.p = {}
         with open(dataset_path, "r") as f:
             self.p = json.loads(f.read())
         f.close()
+        self.p["path"] = os.path.join(os.path.dirname(dataset_path), self.p["path"])
+        self.index_path = os.path.splitext(dataset_path)[0] + ".index.npz"
+        # Shortcut for column data
+        self.ESSAY_COL = self.p["columns"]["essay"]
+        self.SCORE_COL = self.p["columns"]["score"]
+        self.PROMPT_COL = self.p["columns"]["prompt"]
         # Load data
+        with profiler.timer("data.load"):
+            if self.lazy:
+                self.load_lazy()
+            else:
+                self.load()
+        # Build prompt index and normalized scores
+        self.build_columns()
+        # Compile special tokens
+        self.compile_special_tokens()
+        # Sentence tokenizer is loaded on first use
+        self.sentence_tokenizer = None
+
+    def __getstate__(self) -> dict:
+        """Only constructor arguments are pickled. The dataset is loaded again when unpickled (e.g. in worker processes)."""
+        return {
+            "dataset_path": self.dataset_path,
+            "printer_format": self.printer_format,
+            "lazy": self.lazy,
+            "essay_cache_size": self.essay_cache_size
+        }
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def load(self):
+        """Reads the whole dataset into memory and parses prompts and scores into typed arrays."""
         self.d = []
-        self.p["path"] = os.path.join(os.path.dirname(dataset_path), self.p["path"])
         with open(self.p["path"], "r", errors='replace') as f:
             for line in f.readlines():
                 self.d.append(line.split("\t"))
         f.close()
+        profiler.count("data.bytes_read", os.path.getsize(self.p["path"]))
         # Remove the first line
-        if self.p["skip_first_line"]:
+        if self.p["skip_first_line"] and len(self.d) > 0:
             self.d.pop(0)
-        # Shortcut for column data
-        self.ESSAY_COL = self.p["columns"]["essay"]
-        self.SCORE_COL = self.p["columns"]["score"]
-        self.PROMPT_COL = self.p["columns"]["prompt"]
-        # Load tokenizer
-        self.tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
-    
+        n = len(self.d)
+        self.prompts = np.fromiter((int(row[self.PROMPT_COL]) for row in self.d), dtype=np.int32, count=n)
+        self.scores = np.fromiter((int(row[self.SCORE_COL]) for row in self.d), dtype=np.int32, count=n)
+
+    def load_lazy(self):
+        """Memory-maps the dataset and loads the row offsets index (builds it if it is missing or outdated)."""
+        self.d = None
+        # Empty files cannot be memory-mapped
+        self.mm = b""
+        if os.path.getsize(self.p["path"]) > 0:
+            with open(self.p["path"], "rb") as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            f.close()
+        # Describe the source so that outdated indexes are detected
+        stat = os.stat(self.p["path"])
+        signature = json.dumps({
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "columns": self.p["columns"],
+            "skip_first_line": self.p["skip_first_line"],
+            "newlines": "universal"
+        }, sort_keys=True)
+        # Read index from disk
+        if os.path.exists(self.index_path):
+            with np.load(self.index_path, allow_pickle=False) as index:
+                if str(index["signature"]) == signature:
+                    profiler.count("data.bytes_read", os.path.getsize(self.index_path))
+                    self.offsets = index["offsets"]
+                    self.prompts = index["prompts"]
+                    self.scores = index["scores"]
+                    return
+        # Build index
+        profiler.count("data.bytes_read", len(self.mm))
+        # Rows end with \n, \r\n or \r like lines of the text file in eager mode
+        offsets = [0] + [match.end() for match in re.finditer(rb"\r\n|\r|\n", self.mm)]
+        if offsets[-1] < len(self.mm):
+            offsets.append(len(self.mm))
+        if self.p["skip_first_line"] and len(offsets) > 1:
+            offsets.pop(0)
+        prompts, scores = [], []
+        last_col = max(self.PROMPT_COL, self.SCORE_COL)
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            row = self.mm[start:end].split(b"\t", last_col+1)
+            prompts.append(int(row[self.PROMPT_COL]))
+            scores.append(int(row[self.SCORE_COL]))
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.prompts = np.array(prompts, dtype=np.int32)
+        self.scores = np.array(scores, dtype=np.int32)
+        # Save index atomically
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, offsets=self.offsets, prompts=self.prompts, scores=self.scores, signature=np.array(signature))
+        f.close()
+        os.replace(tmp_path, self.index_path)
+        profiler.count("data.bytes_written", os.path.getsize(self.index_path))
+
+    def get_column(self, id: int, col: int) -> str:
+        """Returns the raw value of a column of the essay's row. In lazy mode only this column is decoded."""
+        if not self.lazy:
+            return self.d[id][col]
+        line = self.mm[self.offsets[id]:self.offsets[id+1]]
+        profiler.count("data.bytes_read", len(line))
+        return line.split(b"\t", col+1)[col].decode(errors="replace").replace("\r\n", "\n").replace("\r", "\n")
+    
+    def build_columns(self):
+        """Normalizes scores and builds the prompt to essay ids index."""
+        n = len(self.prompts)
+        # Every prompt must be described in the dataset card
+        invalid = np.flatnonzero((self.prompts < 1) | (self.prompts > len(self.p["prompts"])))
+        if len(invalid) > 0:
+            raise ValueError("Unknown prompt {} of essay {} (the dataset card has {} prompts)".format(int(self.prompts[invalid[0]]), int(invalid[0]), len(self.p["prompts"])))
+        # Normalize scores using min and max scores of each prompt
+        prompt_min = np.array([float(prompt["min_score"]) for prompt in self.p["prompts"]])
+        prompt_max = np.array([float(prompt["max_score"]) for prompt in self.p["prompts"]])
+        self.scores_norm = (self.scores - prompt_min[self.prompts-1]) / (prompt_max - prompt_min)[self.prompts-1]
+        # Group essay ids by prompt
+        order = np.argsort(self.prompts, kind="stable")
+        keys, starts = np.unique(self.prompts[order], return_index=True)
+        self.prompt_index = {int(key): ids for key, ids in zip(keys, np.split(order, starts[1:]))}
+        # Word counts are calculated on demand
+        self.word_counts = np.full(n, -1, dtype=np.int32)
+
+    def compile_special_tokens(self):
+        """Compiles all special tokens into a single regular expression."""
+        self.alternative_tokens = dict(zip(self.p["special_tokens"], self.p["alternative_tokens"]))
+        # Longer tokens go first, so that tokens sharing a prefix are matched correctly
+        tokens = sorted(self.p["special_tokens"], key=len, reverse=True)
+        self.special_tokens_regex = None
+        if len(tokens) > 0:
+            self.special_tokens_regex = re.compile(r'({})\d*\b'.format("|".join([re.escape(token) for token in tokens])))
+
     #
     # Meta
     #
@@ -87,15 +221,48 @@ class AESData:
     
     def get_essay(self, id: int, replace_special_tokens: bool = True) -> str:
         """Returns the essay's full text. Replaces special tokens with their alternatives if needed"""
-        text = self.d[id][self.ESSAY_COL]
-        if replace_special_tokens:
-            for i in range(len(self.p["special_tokens"])):
-                text = re.sub(r'{}\d*\b'.format(self.p["special_tokens"][i]), self.p["alternative_tokens"][i], text)
+        if not replace_special_tokens:
+            return self.get_column(id, self.ESSAY_COL)
+        # Read from cache
+        if id in self.essay_cache:
+            profiler.count("data.essay_cache.hit")
+            self.essay_cache.move_to_end(id)
+            return self.essay_cache[id]
+        profiler.count("data.essay_cache.miss")
+        with profiler.timer("data.clean_text"):
+            text = self.clean_text(self.get_column(id, self.ESSAY_COL))
+        # Save to cache
+        if self.essay_cache_size != 0:
+            self.essay_cache[id] = text
+            if self.essay_cache_size > 0 and len(self.essay_cache) > self.essay_cache_size:
+                self.essay_cache.popitem(last=False)
         return text
-    
+
+    def clean_text(self, text: str) -> str:
+        """Replaces special tokens in a text with their alternatives."""
+        if self.special_tokens_regex is None:
+            return text
+        return self.special_tokens_regex.sub(lambda match: self.alternative_tokens[match.group(1)], text)
+    
+    @property
+    def tokenizer(self):
+        """Punkt sentence tokenizer (loaded on first use)"""
+        if self.sentence_tokenizer is None:
+            import nltk.data
+            self.sentence_tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+        return self.sentence_tokenizer
+
+    def get_text(self, essay) -> str:
+        """Returns the full text of an essay id or an AESEssay. Special tokens are replaced with their alternatives"""
+        if not isinstance(essay, AESEssay):
+            return self.get_essay(essay)
+        if not "text" in essay.cache:
+            essay.cache["text"] = self.clean_text(essay.text)
+        return essay.cache["text"]
+
     def get_essay_sentences(self, id: int) -> list:
-        """Returns the essay's full text split by sentences"""
-        return self.tokenizer.tokenize(self.get_essay(id))
+        """Returns the essay's full text split by sentences. Accepts an AESEssay as well"""
+        return self.tokenizer.tokenize(self.get_text(id))
 
     def get_essay_arr(self, id: int) -> list:
         """Returns the essay's full text, where each sentence is an array of words."""
@@ -106,19 +273,15 @@ class AESData:
     
     def get_score(self, id: int) -> int:
         """Returns the essay's score."""
-        return int(self.d[id][self.SCORE_COL].replace("\n",""))
+        return int(self.scores[id])
     
     def get_prompt(self, id: int) -> int:
         """Returns the essay's prompt number."""
-        return int(self.d[id][self.PROMPT_COL].replace("\n",""))
+        return int(self.prompts[id])
     
     def get_score_norm(self, id: int) -> float:
         """Returns the essay's normalized score (0-1)."""
-        prompt = self.get_prompt(id)
-        min_score = float(self.get_prompt_min_score(prompt))
-        max_score = float(self.get_prompt_max_score(prompt))
-        score = float(self.get_score(id))
-        return (score - min_score) / (max_score - min_score)
+        return float(self.scores_norm[id])
     
     def get_score_percent(self, id: int) -> float:
         """Returns the essay's score as percent (0-100)."""
@@ -126,11 +289,17 @@ class AESData:
     
     def get_prompt_essays(self, prompt: int) -> list:
         """Returns an array of all ids of essays written for a specified prompt."""
-        ids = []
-        for i in range(len(self.d)):
-            if self.get_prompt(i) == prompt:
-                ids.append(i)
-        return ids
+        return self.get_prompt_ids(prompt).tolist()
+
+    def get_prompt_ids(self, prompt: int) -> np.ndarray:
+        """Returns ids of essays written for a specified prompt as a NumPy array."""
+        return self.prompt_index.get(prompt, np.empty(0, dtype=np.int64))
+
+    def get_word_counts(self, ids: np.ndarray) -> np.ndarray:
+        """Returns word counts of the specified essays. Counts are calculated once and reused."""
+        for id in ids[self.word_counts[ids] < 0]:
+            self.word_counts[id] = len(self.get_essay(id).split(" "))
+        return self.word_counts[ids]
     
     #
     # Counters
@@ -142,11 +311,11 @@ class AESData:
     
     def count_essays(self) -> int:
         """Returns the overall number of essays in a dataset."""
-        return len(self.d)
+        return len(self.prompts)
     
     def count_pompt_essays(self, prompt: int) -> int:
         """Returns the overall number of essays of some specific prompt in a dataset."""
-        return len(self.get_prompt_essays(prompt))
+        return len(self.get_prompt_ids(prompt))
 
     #
     # Statistics
@@ -154,36 +323,19 @@ class AESData:
 
     def get_avg_words(self, prompt: int) -> float:
         """Returns the average word count in essays of some specific prompt in a dataset."""
-        avg_words = 0
-        n = 0
-        for id in self.get_prompt_essays(prompt):
-            #avg_words += len(nltk.word_tokenize(self.get_essay(id)))
-            avg_words += len(self.get_essay(id).split(" "))
-            n += 1
-        return float(avg_words)/float(n)
+        return float(self.get_word_counts(self.get_prompt_ids(prompt)).mean())
     
     def get_stdev_words(self, prompt: int) -> float:
         """Returns the standard deviation of word count in essays of some specific prompt in a dataset."""
-        words = []
-        for id in self.get_prompt_essays(prompt):
-            words.append(len(self.get_essay(id).split(" ")))
-        return statistics.stdev(words)
+        return float(self.get_word_counts(self.get_prompt_ids(prompt)).std(ddof=1))
     
     def get_avg_score(self, prompt: int) -> float:
         """Returns the average score of essays of some specific prompt in a dataset."""
-        avg_score = 0
-        n = 0
-        for id in self.get_prompt_essays(prompt):
-            avg_score += self.get_score(id)
-            n += 1
-        return float(avg_score)/float(n)
+        return float(self.scores[self.get_prompt_ids(prompt)].mean())
     
     def get_stdev_score(self, prompt: int) -> float:
         """Returns the standard deviation of scores of essays of some specific prompt in a dataset."""
-        scores = []
-        for id in self.get_prompt_essays(prompt):
-            scores.append(self.get_score_norm(id))
-        return statistics.stdev(scores)
+        return float(self.scores_norm[self.get_prompt_ids(prompt)].std(ddof=1))
     
     def get_avg_score_norm(self, prompt: int) -> float:
         """Returns the average normalized score of essays of some specific prompt in a dataset."""
@@ -194,21 +346,17 @@ class AESData:
     
     def get_min_score(self, prompt: int) -> int:
         """Returns the minimum score in essays of some specific prompt in a dataset."""
-        min_score = 1000
-        for id in self.get_prompt_essays(prompt):
-            score = self.get_score(id)
-            if score < min_score:
-                min_score = score 
-        return min_score
+        ids = self.get_prompt_ids(prompt)
+        if len(ids) == 0:
+            return 1000
+        return int(self.scores[ids].min())
     
     def get_max_score(self, prompt: int) -> int:
         """Returns the maximum score in essays of some specific prompt in a dataset."""
-        max_score = -1000
-        for id in self.get_prompt_essays(prompt):
-            score = self.get_score(id)
-            if score > max_score:
-                max_score = score 
-        return max_score
+        ids = self.get_prompt_ids(prompt)
+        if len(ids) == 0:
+            return -1000
+        return int(self.scores[ids].max())
 
     #
     # Info
@@ -254,6 +402,7 @@ class AESData:
     
     def print_meta(self):
         """Prints dataset's metadata as a markdown table."""
+        import pandas as pd
         meta = self.get_meta()
         keys = list(meta.keys())
         values = list(meta.values())
@@ -262,6 +411,7 @@ class AESData:
     
     def print_prompts(self):
         """Prints all prompts' metadata as a markdown table."""
+        import pandas as pd
         df = pd.json_normalize(self.get_stats())
         print(df.to_markdown(floatfmt=".2f",tablefmt=self.printer_format,index=False,),"\n")
     
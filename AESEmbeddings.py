@@ -1,17 +1,251 @@
 import AESData
+from AESProfiler import profiler
+import contextlib
 import os
 import json
-import torch
-from sentence_transformers import SentenceTransformer
-from transformers import BertTokenizer, BertModel
+import re
+import time
+import hashlib
+import multiprocessing
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class AESEmbeddingStore:
+    """Consolidated storage for embeddings.
+    All vectors are kept in one contiguous memory-mapped .npy matrix. Keys of new rows are appended to a log next to it (line i is the key of row i).
+    Several instances (also in different processes) can share a store: writes hold a file lock and pick up rows added by other instances first."""
+
+    dtypes = ["float32", "float16", "int8"]
+
+    def __init__(self, path: str, dtype: str = "float32"):
+        """Constructor. `path` is the location of the store without extension.
+        `dtype` is the storage precision: float32, float16 or int8 (quantized with one scale per vector)."""
+        if not dtype in self.dtypes:
+            raise ValueError("Unknown dtype: {}. Available: {}".format(dtype, ", ".join(self.dtypes)))
+        self.path = path
+        self.dtype = dtype
+        self.matrix_path = path + ".npy"
+        self.scales_path = path + ".scales.npy"
+        self.keys_path = path + ".keys"
+        self.index_path = path + ".index.json"
+        self.lock_path = path + ".lock"
+        self.matrix = None
+        self.matrix_inode = None
+        self.scales = None
+        self.index = {}
+        self.rows = 0
+        # Bytes of the key log that are loaded
+        self.keys_size = 0
+        with self.lock():
+            self.convert_index()
+            self.refresh()
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Holds an exclusive lock of the store (on systems without fcntl, the store must not be shared)"""
+        with open(self.lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+    def refresh(self):
+        """Loads keys added by other instances and opens the matrix again if it was replaced by a larger one. Called with the lock held"""
+        self.load_keys()
+        if not os.path.exists(self.matrix_path) or os.stat(self.matrix_path).st_ino == self.matrix_inode:
+            return
+        self.matrix_inode = os.stat(self.matrix_path).st_ino
+        self.matrix = np.load(self.matrix_path, mmap_mode="r")
+        if self.matrix.dtype != np.dtype(self.dtype):
+            raise ValueError("Store {} contains {} vectors, not {}".format(self.matrix_path, self.matrix.dtype, self.dtype))
+        if self.dtype == "int8":
+            self.scales = np.load(self.scales_path, mmap_mode="r")
+
+    def is_outdated(self) -> bool:
+        """Check if other instances added keys since the last refresh"""
+        return os.path.exists(self.keys_path) and os.path.getsize(self.keys_path) != self.keys_size
+
+    def convert_index(self):
+        """Converts a JSON index of older versions to the key log"""
+        if not os.path.exists(self.index_path) or os.path.exists(self.keys_path):
+            return
+        with open(self.index_path, "r") as f:
+            meta = json.loads(f.read())
+        f.close()
+        keys = sorted(meta["keys"].keys(), key=lambda key: meta["keys"][key])
+        with open(self.keys_path + ".tmp", "w") as f:
+            f.write("".join([key + "\n" for key in keys]))
+        f.close()
+        os.replace(self.keys_path + ".tmp", self.keys_path)
+        os.remove(self.index_path)
+
+    def load_keys(self):
+        """Loads keys appended to the log since the last call. An incomplete last line (an interrupted write) is ignored"""
+        if not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self.keys_size)
+            data = f.read()
+        f.close()
+        data = data[:data.rfind(b"\n")+1]
+        for key in data.decode().split():
+            self.index[key] = self.rows
+            self.rows += 1
+        self.keys_size += len(data)
+
+    def append_keys(self, keys: list):
+        """Appends keys of new rows to the log. Called after the vectors are flushed, so the log never points to unwritten rows"""
+        data = "".join([key + "\n" for key in keys]).encode()
+        with open(self.keys_path, "ab") as f:
+            # Remove an incomplete line of an interrupted write
+            f.truncate(self.keys_size)
+            f.write(data)
+        f.close()
+        self.keys_size += len(data)
+
+    def __contains__(self, key: str) -> bool:
+        if not key in self.index and self.is_outdated():
+            with self.lock():
+                self.refresh()
+        return key in self.index
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def keys(self) -> list:
+        """Returns all keys in the store"""
+        return list(self.index.keys())
+
+    def get(self, key: str) -> np.ndarray:
+        """Returns the vector stored under the key. Float vectors are returned without copying, int8 vectors are dequantized"""
+        row = self.index[key]
+        profiler.count("embeddings.bytes_read", self.matrix.itemsize * self.matrix.shape[1])
+        if self.dtype == "int8":
+            return self.matrix[row].astype(np.float32) * self.scales[row]
+        return self.matrix[row]
+
+    def get_matrix(self, keys: list = None) -> np.ndarray:
+        """Returns vectors of specified keys as a matrix. If keys are not specified, the whole matrix is returned (without copying for float vectors)"""
+        if self.matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        rows = slice(0, self.rows) if keys is None else [self.index[key] for key in keys]
+        profiler.count("embeddings.bytes_read", (self.rows if keys is None else len(keys)) * self.matrix.itemsize * self.matrix.shape[1])
+        if self.dtype == "int8":
+            return self.matrix[rows].astype(np.float32) * self.scales[rows, np.newaxis]
+        return self.matrix[rows]
+
+    def reserve(self, rows: int, dim: int):
+        """Makes sure that the matrix has space for `rows` more vectors of size `dim`. Opens the matrix for writing"""
+        capacity = 0 if self.matrix is None else self.matrix.shape[0]
+        if self.matrix is not None and self.matrix.shape[1] != dim:
+            raise ValueError("Vector size {} does not match the store ({})".format(dim, self.matrix.shape[1]))
+        if self.rows + rows <= capacity:
+            if self.matrix.mode != "r+":
+                self.matrix = np.load(self.matrix_path, mmap_mode="r+")
+                if self.dtype == "int8":
+                    self.scales = np.load(self.scales_path, mmap_mode="r+")
+            return
+        # Grow the matrix into a new file and replace the old one
+        capacity = max(2*capacity, self.rows + rows, 1024)
+        self.matrix = self.grow(self.matrix_path, self.matrix, (capacity, dim), self.dtype)
+        if self.dtype == "int8":
+            self.scales = self.grow(self.scales_path, self.scales, (capacity,), "float32")
+
+    def grow(self, path: str, array: np.ndarray, shape: tuple, dtype: str) -> np.ndarray:
+        """Copies the array into a new larger .npy file, replaces the old file and opens the new one for writing"""
+        tmp_path = path + ".tmp"
+        new_array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+        if array is not None:
+            new_array[:self.rows] = array[:self.rows]
+        new_array.flush()
+        del new_array
+        os.replace(tmp_path, path)
+        if path == self.matrix_path:
+            self.matrix_inode = os.stat(path).st_ino
+        return np.load(path, mmap_mode="r+")
+
+    def put_many(self, keys: list, vectors: np.ndarray):
+        """Saves vectors under the keys. Existing keys are overwritten"""
+        with self.lock():
+            self.refresh()
+            self.write(keys, vectors)
+
+    def write(self, keys: list, vectors: np.ndarray):
+        """Saves vectors under the keys. Called with the lock held"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.reserve(len(keys), vectors.shape[1])
+        # Quantize vectors symmetrically, one scale per vector
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            vectors = np.clip(np.round(vectors / scales[:, np.newaxis]), -127, 127)
+        new_keys = []
+        for i, key in enumerate(keys):
+            if key not in self.index:
+                self.index[key] = self.rows
+                self.rows += 1
+                new_keys.append(key)
+            self.matrix[self.index[key]] = vectors[i]
+            if self.dtype == "int8":
+                self.scales[self.index[key]] = scales[i]
+        self.matrix.flush()
+        if self.dtype == "int8":
+            self.scales.flush()
+        profiler.count("embeddings.bytes_written", len(keys) * self.matrix.itemsize * self.matrix.shape[1])
+        if len(new_keys) > 0:
+            self.append_keys(new_keys)
+
+    def put(self, key: str, vector: np.ndarray):
+        """Saves a vector under the key"""
+        self.put_many([key], np.asarray(vector)[np.newaxis])
+
+def resolve_commit(name: str, revision: str) -> str:
+    """Returns the commit a model revision points to. Local models are identified by sizes and modification times of their files.
+    A pinned commit is used as it is. Otherwise the downloaded snapshot is used (the same commit online and offline),
+    the Hugging Face Hub is only asked if the model was not downloaded yet and the revision itself is used if the model is unknown"""
+    if os.path.isdir(name):
+        files = []
+        for root, dirs, names in os.walk(name):
+            for file_name in names:
+                stat = os.stat(os.path.join(root, file_name))
+                files.append([os.path.relpath(os.path.join(root, file_name), name), stat.st_size, stat.st_mtime_ns])
+        return hashlib.sha1(json.dumps(sorted(files)).encode()).hexdigest()
+    if re.fullmatch(r"[0-9a-f]{40}", revision):
+        return revision
+    from huggingface_hub import model_info, snapshot_download
+    try:
+        return os.path.basename(snapshot_download(name, revision=revision, local_files_only=True))
+    except Exception:
+        pass
+    try:
+        return model_info(name, revision=revision).sha
+    except Exception:
+        return revision
 
 class AESEmbeddings:
     """Abstraction for embedding generation and caching"""
 
-    def __init__(self, data: AESData, model_name: str = "bert-base-uncased", tokenizer_name: str = "", max_length: int = -1):
-        """Constructor. Requires model_name and tokenizer. 
+    pooling_strategies = ["cls", "mean", "max", "pooler"]
+
+    def __init__(self, data: AESData, model_name: str = "bert-base-uncased", tokenizer_name: str = "", max_length: int = -1, batch_size: int = 16, num_threads: int = -1, pooling: str = "cls", dtype: str = "float32", windowed: bool = False, window_overlap: int = 128, revision: str = "main"):
+        """Constructor. Requires model_name and tokenizer.
         If tokenizer is not specified, it is assumed that tokenizer_name is a model_name.
-        If max_length is not specified, it is assumed that maximum input length is the maximum input length of a model."""
+        If max_length is not specified, it is assumed that maximum input length is the maximum input length of a model.
+        batch_size sets the number of chunks encoded at once. If num_threads is specified, torch will use that many CPU threads.
+        pooling defines how token embeddings are reduced to one vector: cls, mean, max or pooler (BERT pooler output).
+        dtype defines the precision of cached embeddings: float32, float16 or int8.
+        If windowed is True, essays longer than max_length are split into chunks overlapping by window_overlap tokens instead of being truncated.
+        revision is the model revision (branch, tag or commit) to load. It is resolved to a commit once (from the downloaded snapshot if there is one), cache keys use the commit and that commit is loaded.
+        Pass a commit to pin the model, e.g. to use a newer commit of a branch than the downloaded one."""
+        if not pooling in self.pooling_strategies:
+            raise ValueError("Unknown pooling: {}. Available: {}".format(pooling, ", ".join(self.pooling_strategies)))
         self.data: AESData = data
         self.model_name: str = model_name
         self.tokenizer_name: str = model_name
@@ -21,18 +255,42 @@ class AESEmbeddings:
         self.tokenizer = None
         self.model_loaded: bool = False
         self.max_length = max_length
+        self.requested_max_length = max_length
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.pooling = pooling
+        self.dtype = dtype
+        self.windowed = windowed
+        self.window_overlap = window_overlap
+        self.revision = revision
+        self.commits = {}
         self.cache_path = "cached_embeddings"
-        self.cache_filename = "{}-{}.pt"
-    
+        self.store = None
+
+    def __getstate__(self) -> dict:
+        """Loaded model and opened store are not pickled (e.g. when sent to worker processes)."""
+        state = self.__dict__.copy()
+        state["model"] = None
+        state["tokenizer"] = None
+        state["model_loaded"] = False
+        state["store"] = None
+        return state
+
     def load_model(self):
         """Loads model into memory. Called automatically when needed"""
+        import torch
+        from transformers import BertTokenizerFast, BertModel
         print("Loading {} model...".format(self.model_name))
-        self.tokenizer = BertTokenizer.from_pretrained(self.tokenizer_name)
-        self.model = BertModel.from_pretrained(self.model_name)
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+        with profiler.timer("embeddings.load_model"):
+            self.tokenizer = BertTokenizerFast.from_pretrained(self.tokenizer_name, revision=self.get_load_revision(self.tokenizer_name))
+            self.model = BertModel.from_pretrained(self.model_name, revision=self.get_load_revision(self.model_name))
+        self.model.eval()
         self.model_loaded = True
         if self.max_length == -1:
             self.max_length = self.tokenizer.model_max_length
-    
+
     def is_model_loaded(self) -> bool:
         """Check if model is loaded"""
         return self.model_loaded
@@ -55,72 +313,358 @@ class AESEmbeddings:
         """Get maximum input length for current run"""
         return self.max_length
 
-    def encode_essay(self, int: id):
+    def get_store(self) -> AESEmbeddingStore:
+        """Returns the embedding store of the current model and precision"""
+        if self.store is None:
+            save_path = os.path.join(self.cache_path, self.model_name.split("/")[-1])
+            if not os.path.exists(save_path):
+                os.makedirs(save_path)
+            self.store = AESEmbeddingStore(os.path.join(save_path, "embeddings-{}".format(self.dtype)), self.dtype)
+        return self.store
+
+    def get_commit(self, name: str) -> str:
+        """Returns the commit of the model's (or tokenizer's) revision. Resolved once per instance"""
+        if not name in self.commits:
+            self.commits[name] = resolve_commit(name, self.revision)
+        return self.commits[name]
+
+    def get_load_revision(self, name: str) -> str:
+        """Returns the revision to load: the resolved commit, so that loaded weights match cache keys"""
+        commit = self.get_commit(name)
+        if re.fullmatch(r"[0-9a-f]{40}", commit) and not os.path.isdir(name):
+            return commit
+        return self.revision
+
+    def get_cache_settings(self) -> list:
+        """Returns all settings that affect embeddings (used for cache keys)"""
+        return [self.model_name, self.tokenizer_name, self.get_commit(self.model_name), self.get_commit(self.tokenizer_name), self.requested_max_length, self.pooling, self.windowed and self.window_overlap]
+
+    def get_cache_key(self, text: str) -> str:
+        """Returns the cache key of a text: a hash of the text and the embedding settings"""
+        return hashlib.sha1(json.dumps([text] + self.get_cache_settings()).encode()).hexdigest()
+
+    def encode_essay(self, id: int):
         """Use loaded model to get embeddings from essay"""
-        text = self.data.get_essay(id)
+        text = self.data.get_text(id)
+        import torch
         encoded_input = self.tokenizer(text, return_tensors='pt', truncation=True, max_length=self.max_length)
-        return self.model(**encoded_input)
+        with torch.inference_mode():
+            return self.model(**encoded_input)
+
+    def pool(self, output, attention_mask) -> np.ndarray:
+        """Reduces the model output of a batch to one vector per essay using the selected pooling strategy"""
+        if self.pooling == "pooler":
+            return output.pooler_output.float().numpy()
+        states = output.last_hidden_state.float()
+        if self.pooling == "cls":
+            return states[:, 0].numpy()
+        mask = attention_mask.unsqueeze(-1).bool()
+        if self.pooling == "max":
+            return states.masked_fill(~mask, float("-inf")).max(dim=1).values.numpy()
+        return ((states * mask).sum(dim=1) / mask.sum(dim=1)).numpy()
+
+    def split_into_chunks(self, texts: list) -> list:
+        """Tokenizes texts and splits them into model inputs. Returns a list of (text index, input ids, number of overlapping tokens).
+        Without windowed mode each text is one truncated chunk."""
+        if not self.windowed:
+            encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+            return [(i, input_ids, 0) for i, input_ids in enumerate(encoded)]
+        # Each chunk is wrapped with [CLS] and [SEP] tokens
+        size = self.max_length - 2
+        step = size - self.window_overlap
+        if step <= 0:
+            raise ValueError("window_overlap ({}) must be smaller than {}".format(self.window_overlap, size))
+        chunks = []
+        for i, input_ids in enumerate(self.tokenizer(texts, add_special_tokens=False, verbose=False)["input_ids"]):
+            for start in range(0, max(len(input_ids) - self.window_overlap, 1), step):
+                chunk = [self.tokenizer.cls_token_id] + input_ids[start:start+size] + [self.tokenizer.sep_token_id]
+                chunks.append((i, chunk, 0 if start == 0 else self.window_overlap))
+        return chunks
+
+    def combine_chunks(self, vectors: list, weights: list) -> np.ndarray:
+        """Pools vectors of an essay's chunks into one vector. Weights are the numbers of new tokens in each chunk"""
+        if len(vectors) == 1:
+            return vectors[0]
+        if self.pooling == "max":
+            return np.max(vectors, axis=0)
+        return np.average(vectors, axis=0, weights=weights).astype(np.float32)
+
+    def iter_encoded_batches(self, ids: list):
+        """Use loaded model to get pooled embeddings from multiple essays.
+        Chunks of all essays are ordered by their number of tokens and encoded in shared padded batches of batch_size chunks, so chunks of similar length are padded together.
+        Yields (ids, vectors, number of tokens) of essays whose chunks are all encoded."""
+        texts = [self.data.get_text(id) for id in ids]
+        with profiler.timer("embeddings.tokenize"):
+            chunks = self.split_into_chunks(texts)
+        order = sorted(range(len(chunks)), key=lambda c: len(chunks[c][1]))
+        remaining = [0] * len(ids)
+        for i, input_ids, overlap in chunks:
+            remaining[i] += 1
+        import torch
+        pooled = [([], []) for i in range(len(ids))]
+        tokens = 0
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch = [chunks[c] for c in order[start:start+self.batch_size]]
+                inputs = self.tokenizer.pad({"input_ids": [input_ids for i, input_ids, overlap in batch]}, return_tensors='pt')
+                with profiler.timer("embeddings.forward"):
+                    output = self.model(**inputs)
+                tokens += sum([len(input_ids) for i, input_ids, overlap in batch])
+                profiler.count("embeddings.tokens", sum([len(input_ids) for i, input_ids, overlap in batch]))
+                # Tokens repeated from the previous chunk are not pooled again
+                pool_mask = inputs["attention_mask"].clone()
+                for j, (i, input_ids, overlap) in enumerate(batch):
+                    pool_mask[j, 1:1+overlap] = 0
+                with profiler.timer("embeddings.pool"):
+                    vectors = self.pool(output, pool_mask)
+                weights = pool_mask.sum(dim=1).tolist()
+                # Collect finished essays
+                done = []
+                for j, (i, input_ids, overlap) in enumerate(batch):
+                    pooled[i][0].append(vectors[j])
+                    pooled[i][1].append(weights[j])
+                    remaining[i] -= 1
+                    if remaining[i] == 0:
+                        done.append(i)
+                if len(done) > 0:
+                    yield [ids[i] for i in done], np.stack([self.combine_chunks(*pooled[i]) for i in done]), tokens
+                    tokens = 0
+                    for i in done:
+                        pooled[i] = None
+
+    def encode_essays(self, ids: list) -> np.ndarray:
+        """Use loaded model to get pooled embeddings from multiple essays in padded batches. Rows are in the same order as ids"""
+        outputs = {}
+        for batch_ids, vectors, tokens in self.iter_encoded_batches(ids):
+            outputs.update(zip(batch_ids, vectors))
+        return np.stack([outputs[id] for id in ids])
 
-    def get_embeddings(self, id: int, rewrite=False):
-        """Returns embeddings for essay with specified id and caches the result. 
+    def get_embeddings(self, id: int, rewrite=False) -> np.ndarray:
+        """Returns pooled embeddings for essay with specified id (or an AESEssay) and caches the result.
         If rewrite option is set to True the embeddings will be regenerated again instead of reading the cache."""
-        embeddings = None
-        # Create directory for cache
-        save_path = os.path.join(self.cache_path, self.model_name.split("/")[-1])
-        if not os.path.exists(save_path):
-            os.mkdir(save_path)
-        # Define path for saving tensors
-        save_path = os.path.join(save_path, self.cache_filename.format(self.data.get_dataset_id(), id))
-        # Read from cache if cache exists and not marked for rewrite
-        if os.path.exists(save_path) and not rewrite:
-            embeddings = torch.load(save_path)
-        # Generate embeddings
-        else:
+        store = self.get_store()
+        key = self.get_cache_key(self.data.get_text(id))
+        # Generate embeddings if they are not cached or marked for rewrite
+        if rewrite or key not in store:
+            profiler.count("embeddings.cache.miss")
             # Load model if not loaded
             if not self.model_loaded:
                 self.load_model()
-            # Tokenize
-            embeddings = self.encode_essay(id)
-            # Save emdeddings
-            torch.save(embeddings, save_path)
-        return embeddings
-
-    def cache_all_data(self, rewrite = False):
-        """Generates embeddings and caches them for all essays in dataset.
+            store.put_many([key], self.encode_essays([id]))
+        else:
+            profiler.count("embeddings.cache.hit")
+        # Read from cache
+        return store.get(key)
+
+    def featurize(self, texts: list, prompt: int = -1) -> np.ndarray:
+        """Returns pooled embeddings of essays that are not part of the dataset (texts or AESEssay objects) as a matrix.
+        Essays that are not cached are encoded in shared batches with the loaded model and cached like dataset essays."""
+        essays = [text if isinstance(text, AESData.AESEssay) else AESData.AESEssay(text, prompt) for text in texts]
+        store = self.get_store()
+        keys = [self.get_cache_key(self.data.get_text(essay)) for essay in essays]
+        pending = {}
+        for essay, key in zip(essays, keys):
+            if not key in store and not key in pending:
+                pending[key] = essay
+        profiler.count("embeddings.cache.hit", len(essays) - len(pending))
+        profiler.count("embeddings.cache.miss", len(pending))
+        if len(pending) > 0:
+            if not self.model_loaded:
+                self.load_model()
+            store.put_many(list(pending.keys()), self.encode_essays(list(pending.values())))
+        return store.get_matrix(keys)
+
+    def get_all_embeddings(self) -> np.ndarray:
+        """Returns pooled embeddings of all essays as a matrix, where row i belongs to essay i. All essays must be cached"""
+        return self.get_store().get_matrix([self.get_cache_key(self.data.get_essay(id)) for id in range(self.data.count_essays())])
+
+    def iter_parallel_batches(self, ids: list, workers: int):
+        """Shards ids across worker processes. Each worker loads its own model and uses its share of CPU threads.
+        Yields (ids, vectors, number of tokens) as shards are finished."""
+        num_threads = self.num_threads
+        if num_threads <= 0:
+            num_threads = max(1, (os.cpu_count() or 1) // workers)
+        shard_size = self.batch_size * 8
+        shards = [ids[i:i+shard_size] for i in range(0, len(ids), shard_size)]
+        with multiprocessing.get_context("spawn").Pool(workers, initializer=init_worker, initargs=(self, num_threads)) as pool:
+            for result in pool.imap_unordered(encode_shard, shards):
+                yield result
+
+    def cache_all_data(self, rewrite = False, workers: int = 1):
+        """Generates embeddings and caches them for all essays in dataset. Essays with the same text are encoded once.
+        Essays are encoded in batches of batch_size essays. If workers is greater than 1, essays are encoded in that many processes.
+        Completed essays are logged after each batch, so an interrupted run continues where it stopped.
         Rewrites existing cache if rewrite is True."""
-        for i in range(self.data.count_essays()):
-            self.get_embeddings(i, rewrite=rewrite)
-            print("{}/{}".format(i,self.data.count_essays()))
+        store = self.get_store()
+        progress_path = store.path + ".progress"
+        keys = [self.get_cache_key(self.data.get_essay(id)) for id in range(self.data.count_essays())]
+        # Find essays that are already done
+        done = set()
+        if os.path.exists(progress_path):
+            with open(progress_path, "r") as f:
+                done = set(f.read().split())
+            f.close()
+        if not rewrite:
+            done.update([key for key in keys if key in store])
+        # Take one essay for each text that is not done
+        pending = {}
+        for id, key in enumerate(keys):
+            if not key in done and not key in pending:
+                pending[key] = id
+        ids = list(pending.values())
+        profiler.count("embeddings.cache.hit", len([key for key in keys if key in done]))
+        profiler.count("embeddings.cache.miss", len(ids))
+        if len(ids) == 0:
+            # Nothing left to do, the progress of a finished run must not be reused by later runs
+            if os.path.exists(progress_path):
+                os.remove(progress_path)
+            return
+        # Encode and save embeddings
+        if workers > 1:
+            batches = self.iter_parallel_batches(ids, workers)
+        else:
+            if not self.model_loaded:
+                self.load_model()
+            batches = self.iter_encoded_batches(ids)
+        start_time = time.time()
+        essays = 0
+        tokens = 0
+        with open(progress_path, "a") as progress:
+            for batch_ids, vectors, batch_tokens in batches:
+                batch_keys = [keys[id] for id in batch_ids]
+                store.put_many(batch_keys, vectors)
+                # Log progress
+                progress.write("".join([key + "\n" for key in batch_keys]))
+                progress.flush()
+                # Report throughput
+                essays += len(batch_ids)
+                tokens += batch_tokens
+                elapsed = max(time.time() - start_time, 1e-9)
+                if tokens > 0:
+                    print("{}/{} essays, {:.1f} essays/s, {:.0f} tokens/s".format(essays, len(ids), essays/elapsed, tokens/elapsed))
+                else:
+                    print("{}/{} essays, {:.1f} essays/s".format(essays, len(ids), essays/elapsed))
+        progress.close()
+        os.remove(progress_path)
+
+# Embeddings instance of a worker process
+worker_embeddings = None
+
+def init_worker(embeddings: AESEmbeddings, num_threads: int):
+    """Initializes a worker process of the parallel cache builder"""
+    global worker_embeddings
+    worker_embeddings = embeddings
+    worker_embeddings.num_threads = num_threads
+    worker_embeddings.load_model()
+
+def encode_shard(ids: list) -> tuple:
+    """Encodes a shard of essays in a worker process"""
+    vectors = []
+    tokens = 0
+    for batch_ids, batch_vectors, batch_tokens in worker_embeddings.iter_encoded_batches(ids):
+        vectors.extend(zip(batch_ids, batch_vectors))
+        tokens += batch_tokens
+    return [id for id, vector in vectors], np.stack([vector for id, vector in vectors]), tokens
 
 class AESSentenceEmbeddings(AESEmbeddings):
     """Abstraction for embedding generation and caching using Sentence Transformers"""
 
-    def __init__(self, data: AESData, model_name: str = "sentence-transformers/all-distilroberta-v1", max_length: int = -1):
-        """Constructor. Requires model_name and tokenizer. 
-        If max_length is not specified, it is assumed that maximum input length is the maximum input length of a model."""
+    pooling_strategies = ["sentence-mean", "sentence-max"]
+
+    def __init__(self, data: AESData, model_name: str = "sentence-transformers/all-distilroberta-v1", max_length: int = -1, batch_size: int = 16, num_threads: int = -1, pooling: str = "sentence-mean", dtype: str = "float32", revision: str = "main"):
+        """Constructor. Requires model_name and tokenizer.
+        If max_length is not specified, it is assumed that maximum input length is the maximum input length of a model.
+        batch_size sets the number of essays encoded at once. If num_threads is specified, torch will use that many CPU threads.
+        pooling defines how sentence embeddings are reduced to one vector: sentence-mean or sentence-max.
+        dtype defines the precision of cached embeddings: float32, float16 or int8.
+        revision is the model revision (branch, tag or commit) to load. It is resolved to a commit once (from the downloaded snapshot if there is one), cache keys use the commit and that commit is loaded.
+        Pass a commit to pin the model, e.g. to use a newer commit of a branch than the downloaded one."""
+        if not pooling in self.pooling_strategies:
+            raise ValueError("Unknown pooling: {}. Available: {}".format(pooling, ", ".join(self.pooling_strategies)))
         self.data: AESData = data
         self.model_name: str = model_name
         self.model = None
         self.model_loaded: bool = False
         self.max_length = max_length
+        self.requested_max_length = max_length
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.pooling = pooling
+        self.dtype = dtype
+        self.revision = revision
+        self.commits = {}
         self.cache_path = "cached_sentence_embeddings"
-        self.cache_filename = "{}-{}.pt"
-    
+        self.store = None
+
     def load_model(self):
         """Loads model into memory. Called automatically when needed"""
+        import torch
+        from sentence_transformers import SentenceTransformer
         print("Loading {} model...".format(self.model_name))
-        self.model = SentenceTransformer(self.model_name)
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+        with profiler.timer("embeddings.load_model"):
+            self.model = SentenceTransformer(self.model_name, revision=self.get_load_revision(self.model_name))
         self.model_loaded = True
         if self.max_length == -1:
             self.max_length = self.model.max_seq_length
-    
+
     def get_model_max_length(self) -> int:
         """Get maximum input length of currently loaded model"""
         if not self.model_loaded:
             self.load_model()
         return self.model.max_seq_length
 
+    def get_dimension(self) -> int:
+        """Get size of sentence embeddings of the loaded model"""
+        if hasattr(self.model, "get_embedding_dimension"):
+            return self.model.get_embedding_dimension()
+        return self.model.get_sentence_embedding_dimension()
+
+    def get_cache_settings(self) -> list:
+        """Returns all settings that affect embeddings (used for cache keys)"""
+        return [self.model_name, self.get_commit(self.model_name), self.requested_max_length, self.pooling]
+
     def encode_essay(self, id: int):
         """Use loaded model to get embeddings from essay"""
         sentences = self.data.get_essay_sentences(id)
-        return self.model.encode(sentences)
\ No newline at end of file
+        return self.model.encode(sentences)
+
+    def pool_sentences(self, sentence_embeddings: np.ndarray) -> np.ndarray:
+        """Reduces sentence embeddings of an essay to one vector using the selected pooling strategy. An essay without sentences gets a zero vector"""
+        if len(sentence_embeddings) == 0:
+            return np.zeros(self.get_dimension(), dtype=np.float32)
+        if self.pooling == "sentence-max":
+            return sentence_embeddings.max(axis=0)
+        return sentence_embeddings.mean(axis=0)
+
+    def iter_encoded_batches(self, ids: list):
+        """Use loaded model to get pooled embeddings from multiple essays.
+        Essays are taken in batches of batch_size essays and sentences of a whole batch are passed to SentenceTransformer.encode in one call
+        (batching and padding of sentences is left to Sentence Transformers). Yields (ids, vectors, number of tokens) batch by batch."""
+        import torch
+        for start in range(0, len(ids), self.batch_size):
+            batch = ids[start:start+self.batch_size]
+            sentences = [self.data.get_essay_sentences(id) for id in batch]
+            flat_sentences = [sentence for essay in sentences for sentence in essay]
+            embeddings = np.empty((0, self.get_dimension()), dtype=np.float32)
+            tokens = 0
+            with torch.inference_mode():
+                with profiler.timer("embeddings.forward"):
+                    if len(flat_sentences) > 0:
+                        # Tokens are counted from attention masks of the padded batches that encode passes to the model
+                        masks = []
+                        hook = self.model.register_forward_hook(lambda module, inputs, output: masks.append(output["attention_mask"].sum()))
+                        try:
+                            embeddings = self.model.encode(flat_sentences, batch_size=self.batch_size*8)
+                        finally:
+                            hook.remove()
+                        tokens = int(sum(masks))
+            profiler.count("embeddings.tokens", tokens)
+            # Split sentence embeddings back by essays
+            vectors = []
+            offset = 0
+            for essay in sentences:
+                vectors.append(self.pool_sentences(embeddings[offset:offset+len(essay)]))
+                offset += len(essay)
+            yield batch, np.stack(vectors), tokens
@@ -0,0 +1,199 @@
+#!.env/bin/python
+from AESMetrics import AESMetrics, quadratic_weighted_kappa
+from AESProfiler import profiler
+import hashlib
+import json
+import multiprocessing
+import numpy as np
+import os
+import pickle
+
+class AESEvaluation:
+    """Evaluation of regression models on features datasets (e.g. saved by AESLinguisticFeatures.generate_dataset).
+    A model is fitted for each split (train and test prompts) and feature set and QWK is calculated for each test prompt"""
+
+    def __init__(self, dataset, model = None, cache_path: str = "", scales: list = [100, 10], metrics: AESMetrics = None):
+        """Constructor. Dataset is a DataFrame or a path of a features dataset (csv, parquet, feather or npz).
+        Model is an unfitted scikit-learn regressor (LinearRegression by default), it is cloned for each split and feature set.
+        Fitted models are cached in memory and in cache_path (if specified). Scores are rounded to each scale (n/100, n/10) before QWK is calculated.
+        If metrics of the original dataset are specified, QWK is calculated on the scale of each prompt as well"""
+        if type(dataset) is str:
+            from AESLinguisticFeatures import load_features_dataset
+            dataset = load_features_dataset(dataset)
+        if model is None:
+            from sklearn.linear_model import LinearRegression
+            model = LinearRegression()
+        self.model = model
+        self.cache_path = cache_path
+        self.scales = scales
+        self.metrics = metrics
+        self.feature_names = [key for key in dataset.columns if not key in ["id", "prompt", "score"]]
+        self.x = dataset[self.feature_names].to_numpy(dtype=np.float64)
+        self.y = dataset["score"].to_numpy(dtype=np.float64)
+        self.prompts = dataset["prompt"].to_numpy()
+        # Rows of each prompt are selected once
+        self.prompt_rows = {int(prompt): np.flatnonzero(self.prompts == prompt) for prompt in np.unique(self.prompts)}
+        self.dataset_hash = hashlib.sha1(json.dumps(self.feature_names).encode() + self.x.tobytes() + self.y.tobytes() + self.prompts.tobytes()).hexdigest()[:16]
+        self.splits = {}
+        self.feature_sets = {"all": self.feature_names}
+        self.models = {}
+
+    def __getstate__(self) -> dict:
+        """Fitted models are not pickled (e.g. to worker processes)"""
+        state = self.__dict__.copy()
+        state["models"] = {}
+        return state
+
+    def add_split(self, name: str, train_prompts: list, test_prompts: list):
+        """Add a split. A model is fitted on essays of train prompts and evaluated on each test prompt"""
+        for prompt in list(train_prompts) + list(test_prompts):
+            if not prompt in self.prompt_rows:
+                raise ValueError("Unknown prompt: {}".format(prompt))
+        self.splits[name] = ([int(prompt) for prompt in train_prompts], [int(prompt) for prompt in test_prompts])
+
+    def add_leave_one_prompt_out(self):
+        """Add a split for each prompt, the model is fitted on all other prompts"""
+        for prompt in self.prompt_rows:
+            self.add_split("lopo-{}".format(prompt), [other for other in self.prompt_rows if other != prompt], [prompt])
+
+    def add_feature_set(self, name: str, features: list):
+        """Add a feature set (models are evaluated on each feature set)"""
+        for key in features:
+            if not key in self.feature_names:
+                raise ValueError("Unknown feature: {}".format(key))
+        self.feature_sets[name] = list(features)
+
+    def add_ablation_feature_sets(self):
+        """Add a feature set without each feature ("-chars", "-words", ...)"""
+        for key in self.feature_names:
+            self.add_feature_set("-" + key, [other for other in self.feature_names if other != key])
+
+    def get_model_key(self, split: str, feature_set: str) -> str:
+        """Get a hash of the dataset, train prompts, features and model parameters"""
+        inputs = [self.dataset_hash, self.splits[split][0], self.feature_sets[feature_set], repr(self.model)]
+        return hashlib.sha1(json.dumps(inputs).encode()).hexdigest()[:16]
+
+    def get_cached_model(self, key: str):
+        """Get a fitted model from memory or from cache_path (None if it is not cached)"""
+        if key in self.models:
+            profiler.count("evaluation.model_cache.hit")
+            return self.models[key]
+        path = os.path.join(self.cache_path, key + ".pkl")
+        if self.cache_path != "" and os.path.exists(path):
+            profiler.count("evaluation.model_cache.hit")
+            with open(path, "rb") as f:
+                self.models[key] = pickle.load(f)
+            f.close()
+            return self.models[key]
+        profiler.count("evaluation.model_cache.miss")
+        return None
+
+    def cache_model(self, key: str, model):
+        """Save a fitted model to memory and to cache_path (if specified)"""
+        self.models[key] = model
+        if self.cache_path == "":
+            return
+        if not os.path.exists(self.cache_path):
+            os.makedirs(self.cache_path)
+        path = os.path.join(self.cache_path, key + ".pkl")
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(model, f)
+        f.close()
+        os.replace(path + ".tmp", path)
+
+    def get_frame(self, rows: np.ndarray, features: list) -> "pd.DataFrame":
+        """Get features of rows as a DataFrame (models keep names of features)"""
+        import pandas as pd
+        columns = [self.feature_names.index(key) for key in features]
+        return pd.DataFrame(self.x[np.ix_(rows, columns)], columns=features)
+
+    def fit(self, split: str, feature_set: str):
+        """Fit a model on train prompts of a split"""
+        from sklearn.base import clone
+        rows = np.concatenate([self.prompt_rows[prompt] for prompt in self.splits[split][0]])
+        model = clone(self.model)
+        with profiler.timer("evaluation.fit"):
+            model.fit(self.get_frame(rows, self.feature_sets[feature_set]), self.y[rows])
+        return model
+
+    def get_model(self, split: str, feature_set: str = "all"):
+        """Get a fitted model of a split and feature set (it is fitted if it is not cached)"""
+        key = self.get_model_key(split, feature_set)
+        model = self.get_cached_model(key)
+        if model is None:
+            model = self.fit(split, feature_set)
+            self.cache_model(key, model)
+        return model
+
+    def get_predictions(self, split: str, feature_set: str = "all", model = None) -> tuple:
+        """Predict scores of all test prompts of a split at once. Returns normalized scores, predicted scores and prompts"""
+        if model is None:
+            model = self.get_model(split, feature_set)
+        rows = np.concatenate([self.prompt_rows[prompt] for prompt in self.splits[split][1]])
+        return self.y[rows], model.predict(self.get_frame(rows, self.feature_sets[feature_set])), self.prompts[rows]
+
+    def evaluate_model(self, split: str, feature_set: str, model = None) -> tuple:
+        """Evaluate a model on each test prompt of a split (the model is fitted if it is not specified). Returns the model and rows of results"""
+        if model is None:
+            model = self.fit(split, feature_set)
+        test_prompts = self.splits[split][1]
+        y, y_predict = self.get_predictions(split, feature_set, model)[:2]
+        results = []
+        start = 0
+        for prompt in test_prompts:
+            end = start + len(self.prompt_rows[prompt])
+            result = {"split": split, "features": feature_set, "prompt": prompt, "essays": end - start}
+            with profiler.timer("evaluation.qwk"):
+                for scale in self.scales:
+                    result["qwk_{}".format(scale)] = quadratic_weighted_kappa(np.rint(y[start:end] * scale).astype(np.int64), np.rint(y_predict[start:end] * scale).astype(np.int64))
+                if self.metrics is not None:
+                    result["qwk"] = quadratic_weighted_kappa(self.metrics.to_native(y[start:end], prompt), self.metrics.to_native(y_predict[start:end], prompt), self.metrics.get_labels(prompt))
+            results.append(result)
+            start = end
+        return model, results
+
+    def evaluate(self, splits: list = None, feature_sets: list = None, workers: int = 1) -> "pd.DataFrame":
+        """Evaluate models on all splits and feature sets (or only the specified ones). Models that are not cached are fitted in worker processes.
+        Returns a table of results with a row for each split, feature set and test prompt"""
+        import pandas as pd
+        if splits is None:
+            splits = list(self.splits.keys())
+        if feature_sets is None:
+            feature_sets = list(self.feature_sets.keys())
+        if len(splits) == 0:
+            raise ValueError("No splits to evaluate. Call add_split() or add_leave_one_prompt_out() first")
+        jobs = [(split, feature_set) for split in splits for feature_set in feature_sets]
+        results = {}
+        # Cached models are only evaluated
+        missing = []
+        for split, feature_set in jobs:
+            model = self.get_cached_model(self.get_model_key(split, feature_set))
+            if model is None:
+                missing.append((split, feature_set))
+            else:
+                results[(split, feature_set)] = self.evaluate_model(split, feature_set, model)[1]
+        if workers > 1 and len(missing) > 1:
+            with multiprocessing.get_context("spawn").Pool(min(workers, len(missing)), initializer=init_worker, initargs=(self,)) as pool:
+                fitted = pool.map(evaluate_job, missing)
+        else:
+            fitted = [self.evaluate_model(split, feature_set) for split, feature_set in missing]
+        for (split, feature_set), (model, rows) in zip(missing, fitted):
+            self.cache_model(self.get_model_key(split, feature_set), model)
+            results[(split, feature_set)] = rows
+        return pd.DataFrame([row for job in jobs for row in results[job]])
+
+    def print_results(self, results: "pd.DataFrame"):
+        """Output table of results to command line"""
+        print(results.to_string(index=False, float_format="{:.4f}".format))
+
+# Evaluation of the current worker process
+worker_evaluation = None
+
+def init_worker(evaluation: AESEvaluation):
+    """Set the evaluation used by the worker process"""
+    global worker_evaluation
+    worker_evaluation = evaluation
+
+def evaluate_job(job: tuple) -> tuple:
+    """Fit and evaluate a model of a split and feature set in a worker process"""
+    return worker_evaluation.evaluate_model(*job)
@@ -1,47 +1,386 @@
 #!.env/bin/python
-from AESData import AESData
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.corpus import stopwords
-from nltk import pos_tag
-import enchant
+from AESData import AESData, AESEssay
+from AESProfiler import profiler
+from collections import Counter
+import functools
+import hashlib
+import importlib.metadata
+import json
+import multiprocessing
+import numpy as np
 import re
 import os
 
+# Spellcheck dictionaries shared by all instances
+spellcheck_dicts = {}
+
+def get_spellcheck_dict(language: str = "en_US") -> "enchant.Dict":
+    """Returns a shared enchant dictionary for the language"""
+    if not language in spellcheck_dicts:
+        import enchant
+        spellcheck_dicts[language] = enchant.Dict(language)
+    return spellcheck_dicts[language]
+
+@functools.lru_cache(maxsize=65536)
+def check_spelling(word: str, language: str = "en_US") -> bool:
+    """Check spelling of a word. Results are cached and shared by all instances, so each distinct word reaches enchant once"""
+    with profiler.timer("features.enchant"):
+        return get_spellcheck_dict(language).check(word)
+
+@functools.lru_cache(maxsize=1)
+def get_nltk_version() -> str:
+    """Returns the installed NLTK version without importing NLTK"""
+    return importlib.metadata.version("nltk")
+
+class AESTokenCache:
+    """Persistent cache of tokenized essays.
+    Words are stored as interned ids, POS tags as small integer codes and sentences as character spans.
+    Each is kept in one flat array with start and end offsets of every essay (-1 if the essay is not cached).
+    A hash of each essay's text is saved as well, so that tokens of edited or reordered essays are not used."""
+
+    artifacts = ["words", "pos_tags", "sentences"]
+
+    def __init__(self, path: str, data: AESData):
+        """Constructor. Requires the path of the cache file and the dataset. The file is read on first use"""
+        self.path = path
+        self.data = data
+        self.count = data.count_essays()
+        self.loaded = False
+        self.arrays = {}
+        self.vocab = []
+        self.tags = []
+        self.vocab_lengths = None
+        self.hashes = None
+
+    def get_hashes(self) -> np.ndarray:
+        """Returns hashes of the raw texts of all essays (calculated once)"""
+        if self.hashes is None:
+            self.hashes = np.array([int(hashlib.sha1(self.data.get_essay(id, replace_special_tokens=False).encode()).hexdigest()[:16], 16) for id in range(self.count)], dtype=np.uint64)
+        return self.hashes
+
+    def load(self):
+        """Loads the cache file if it exists. Essays whose text changed since the cache was saved are not cached"""
+        self.loaded = True
+        if not os.path.exists(self.path):
+            return
+        profiler.count("features.token_cache.bytes_read", os.path.getsize(self.path))
+        with np.load(self.path, allow_pickle=False) as f:
+            if not "hashes" in f:
+                return
+            saved_hashes = f["hashes"]
+            n = min(len(saved_hashes), self.count)
+            valid = saved_hashes[:n] == self.get_hashes()[:n]
+            self.vocab = f["vocab"].tolist()
+            self.tags = f["tags"].tolist()
+            for name in self.artifacts:
+                starts = np.full(self.count, -1, dtype=np.int64)
+                ends = np.full(self.count, -1, dtype=np.int64)
+                starts[:n] = np.where(valid, f[name + "_starts"][:n], -1)
+                ends[:n] = np.where(valid, f[name + "_ends"][:n], -1)
+                self.arrays[name] = (f[name], starts, ends)
+        f.close()
+
+    def get(self, name: str, id: int) -> np.ndarray:
+        """Returns cached values of an essay or None if the essay is not cached"""
+        if not self.loaded:
+            self.load()
+        if not name in self.arrays:
+            return None
+        values, starts, ends = self.arrays[name]
+        if starts[id] < 0:
+            return None
+        return values[starts[id]:ends[id]]
+
+    def get_word_lengths(self, id: int) -> np.ndarray:
+        """Returns lengths of cached words of an essay or None"""
+        values = self.get("words", id)
+        if values is None:
+            return None
+        if self.vocab_lengths is None:
+            self.vocab_lengths = np.array([len(word) for word in self.vocab], dtype=np.int32)
+        return self.vocab_lengths[values]
+
+    def get_words(self, id: int) -> list:
+        """Returns cached words of an essay or None"""
+        values = self.get("words", id)
+        return None if values is None else [self.vocab[i] for i in values.tolist()]
+
+    def get_pos_tags(self, id: int) -> list:
+        """Returns cached POS tags of an essay or None"""
+        values = self.get("pos_tags", id)
+        return None if values is None else [self.tags[i] for i in values.tolist()]
+
+    def get_sentence_spans(self, id: int) -> list:
+        """Returns cached (start, end) character spans of an essay's sentences or None"""
+        values = self.get("sentences", id)
+        return None if values is None else values.reshape(-1, 2).tolist()
+
+    def pack(self, items: list, codes: dict, dtype) -> tuple:
+        """Packs per-essay lists into a flat array of codes with start and end offsets. Values missing from codes are added"""
+        starts = np.full(self.count, -1, dtype=np.int64)
+        ends = np.full(self.count, -1, dtype=np.int64)
+        values = []
+        for id, item in enumerate(items):
+            if item is None:
+                continue
+            starts[id] = len(values)
+            for value in item:
+                if not value in codes:
+                    codes[value] = len(codes)
+                values.append(codes[value])
+            ends[id] = len(values)
+        return np.array(values, dtype=dtype), starts, ends
+
+    def save(self, words: list, pos_tags: list, sentence_spans: list):
+        """Saves words, POS tags and sentence spans of all essays (None for essays that are not tokenized). Replaces the file atomically"""
+        arrays = {"hashes": self.get_hashes()}
+        vocab = {}
+        tags = {}
+        arrays["words"], arrays["words_starts"], arrays["words_ends"] = self.pack(words, vocab, np.int32)
+        arrays["pos_tags"], arrays["pos_tags_starts"], arrays["pos_tags_ends"] = self.pack(pos_tags, tags, np.uint16)
+        # Sentence spans are packed as plain numbers
+        starts = np.full(self.count, -1, dtype=np.int64)
+        ends = np.full(self.count, -1, dtype=np.int64)
+        values = []
+        for id, spans in enumerate(sentence_spans):
+            if spans is None:
+                continue
+            starts[id] = len(values)
+            for start, end in spans:
+                values.extend([start, end])
+            ends[id] = len(values)
+        arrays["sentences"], arrays["sentences_starts"], arrays["sentences_ends"] = np.array(values, dtype=np.int32), starts, ends
+        if len(tags) < 256:
+            arrays["pos_tags"] = arrays["pos_tags"].astype(np.uint8)
+        arrays["vocab"] = np.array(list(vocab.keys()), dtype=str)
+        arrays["tags"] = np.array(list(tags.keys()), dtype=str)
+        # Save to disk
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        f.close()
+        os.replace(self.path + ".tmp", self.path)
+        profiler.count("features.token_cache.bytes_written", os.path.getsize(self.path))
+        # Use saved data from now on
+        self.loaded = True
+        self.vocab = list(vocab.keys())
+        self.tags = list(tags.keys())
+        self.vocab_lengths = None
+        self.arrays = {name: (arrays[name], arrays[name + "_starts"], arrays[name + "_ends"]) for name in self.artifacts}
+
+class AESFeatureWriter:
+    """Writes a features dataset incrementally in row groups. The format is selected by the file extension: 
+    .csv, .parquet or .feather (require pyarrow) and .npz. Column types and feature descriptions are stored in metadata 
+    of the binary formats. The file is replaced atomically when the writer is closed."""
+
+    formats = [".csv", ".parquet", ".feather", ".npz"]
+
+    def __init__(self, path: str, columns: list, dtypes: list, meta: dict, column_names: bool = True, row_group_size: int = 1000):
+        """Constructor. Requires names and NumPy types of all columns and a metadata dictionary.
+        If pyarrow is not installed, Parquet and Feather datasets are saved as .npz instead."""
+        self.path = path
+        self.format = os.path.splitext(path)[1].lower()
+        if not self.format in self.formats:
+            raise ValueError("Unknown dataset format: {}. Supported formats: {}".format(self.format, ", ".join(self.formats)))
+        if self.format in [".parquet", ".feather"]:
+            try:
+                import pyarrow
+            except ImportError:
+                self.path = os.path.splitext(path)[0] + ".npz"
+                self.format = ".npz"
+                print("Error! pyarrow is not installed. Dataset is saved to {}".format(self.path))
+        self.columns = columns
+        self.dtypes = dtypes
+        self.meta = dict(meta, columns=columns, dtypes=dtypes)
+        self.column_names = column_names
+        self.row_group_size = row_group_size
+        self.rows = []
+        self.groups = []
+        self.file = None
+        self.writer = None
+        self.tmp_path = self.path + ".tmp"
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def get_arrow_schema(self):
+        """Get pyarrow schema of the dataset with metadata"""
+        import pyarrow as pa
+        fields = [pa.field(column, pa.from_numpy_dtype(np.dtype(dtype))) for column, dtype in zip(self.columns, self.dtypes)]
+        return pa.schema(fields, metadata={"aes_tools": json.dumps(self.meta)})
+
+    def write(self, row: list):
+        """Add a row. Rows are written when a row group is full"""
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows as a row group"""
+        if self.format == ".csv":
+            if self.file is None:
+                self.file = open(self.tmp_path, "w")
+                if self.column_names:
+                    self.file.write(",".join(self.columns)+"\n")
+            for row in self.rows:
+                self.file.write(",".join([str(value) for value in row])+"\n")
+            self.rows = []
+            return
+        columns = [np.array([row[i] for row in self.rows], dtype=dtype) for i, dtype in enumerate(self.dtypes)]
+        self.rows = []
+        if self.format == ".npz":
+            self.groups.append(columns)
+            return
+        import pyarrow as pa
+        schema = self.get_arrow_schema()
+        if self.writer is None:
+            if self.format == ".parquet":
+                import pyarrow.parquet as pq
+                self.writer = pq.ParquetWriter(self.tmp_path, schema)
+            else:
+                self.writer = pa.ipc.new_file(self.tmp_path, schema)
+        self.writer.write_batch(pa.record_batch(columns, schema=schema))
+
+    def close(self):
+        """Write remaining rows and move the dataset to its path"""
+        if len(self.rows) > 0 or (self.file is None and self.writer is None):
+            self.flush()
+        if self.file is not None:
+            self.file.close()
+        if self.writer is not None:
+            self.writer.close()
+        if self.format == ".npz":
+            arrays = {column: np.concatenate([group[i] for group in self.groups]) for i, column in enumerate(self.columns)}
+            arrays["__meta__"] = np.array(json.dumps(self.meta))
+            with open(self.tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+            f.close()
+        os.replace(self.tmp_path, self.path)
+
+def load_features_dataset(path: str):
+    """Load a features dataset saved by generate_dataset as a pandas DataFrame. 
+    Metadata of binary formats (column types and feature descriptions) is available in DataFrame.attrs["aes_tools"]"""
+    import pandas as pd
+    extension = os.path.splitext(path)[1].lower()
+    meta = {}
+    if extension == ".csv":
+        frame = pd.read_csv(path, float_precision="round_trip")
+    elif extension == ".npz":
+        with np.load(path, allow_pickle=False) as f:
+            meta = json.loads(str(f["__meta__"]))
+            frame = pd.DataFrame({column: f[column] for column in meta["columns"]})
+        f.close()
+    elif extension in [".parquet", ".feather"]:
+        import pyarrow as pa
+        if extension == ".parquet":
+            import pyarrow.parquet as pq
+            table = pq.read_table(path)
+        else:
+            table = pa.ipc.open_file(path).read_all()
+        metadata = table.schema.metadata or {}
+        if b"aes_tools" in metadata:
+            meta = json.loads(metadata[b"aes_tools"])
+        frame = table.to_pandas()
+    else:
+        raise ValueError("Unknown dataset format: {}".format(extension))
+    frame.attrs["aes_tools"] = meta
+    return frame
+
 class AESLinguisticFeatures:
     """Abstraction for linguistic features calculation in essays"""
     
-    def __init__(self, data: AESData, difficult_words_path: str = "difficult_words.txt", stopwords_path: str = ""):
-        """Constructor. Requires AESData to work with. A path to custom list of difficult words and stop words can be specified (Optional)"""
+    def __init__(self, data: AESData, difficult_words_path: str = "difficult_words.txt", stopwords_path: str = "", token_cache_path: str = "cached_tokens"):
+        """Constructor. Requires AESData to work with. A path to custom list of difficult words and stop words can be specified (Optional).
+        Tokenized essays and POS tags are cached in token_cache_path between runs (Optional, empty string disables the cache)."""
         self.data = data
+        self.difficult_words_path = difficult_words_path
+        self.stopwords_path = stopwords_path
+        self.token_cache_path = token_cache_path
         self.sentence_cache = [[] for i in range(self.data.count_essays())]
         self.word_cache = [[] for i in range(self.data.count_essays())]
         self.pos_tags_cache = [[] for i in range(self.data.count_essays())]
         self.total_average_word_length = -1
         self.tokenize_filter = '[^A-Za-z\- ]+'
-        self.spellcheck_dict = enchant.Dict("en_US")
+        self.spellcheck_language = "en_US"
         # Load difficult words list
-        self.difficult_words_list = []
+        self.difficult_words_list = frozenset()
         if os.path.exists(difficult_words_path):
             with open(difficult_words_path, "r") as f:
-                self.difficult_words_list = f.read().split("\n")
+                self.difficult_words_list = frozenset(f.read().split("\n"))
             f.close()
         else:
             print("Error! Path: {} not found!".format(difficult_words_path))
         # Load stopwords list
-        self.stopwords_list = []
+        self.stopwords_list = frozenset()
         if stopwords_path == "":
-            self.stopwords_list = set(stopwords.words('english'))
+            from nltk.corpus import stopwords
+            self.stopwords_list = frozenset(stopwords.words('english'))
         elif os.path.exists(stopwords_path):
             with open(stopwords_path, "r") as f:
-                self.stopwords_list = f.read().split("\n")
+                self.stopwords_list = frozenset(f.read().split("\n"))
             f.close()
         else:
             print("Error! Path {} not found!".format(stopwords_path))
+        # Stop words are matched case-insensitively. Difficult words are matched exactly (the list contains proper nouns)
+        self.stopwords_lower = frozenset([word.lower() for word in self.stopwords_list])
+        # Hashes of the lists (used to invalidate saved features)
+        self.difficult_words_hash = hashlib.sha1(json.dumps(sorted(self.difficult_words_list)).encode()).hexdigest()[:16]
+        self.stopwords_hash = hashlib.sha1(json.dumps(sorted(self.stopwords_lower)).encode()).hexdigest()[:16]
+        # Open token cache. The file name depends on all settings that affect tokenization and tagging
+        self.token_cache = None
+        self.token_cache_changed = False
+        if token_cache_path != "":
+            settings = json.dumps([self.tokenize_filter, sorted(self.stopwords_lower), get_nltk_version(), self.data.get_special_tokens(), self.data.p["alternative_tokens"]])
+            filename = "{}-{}.npz".format(self.data.get_dataset_id(), hashlib.sha1(settings.encode()).hexdigest()[:16])
+            self.token_cache = AESTokenCache(os.path.join(token_cache_path, filename), self.data)
+        # Corpus statistics are saved next to the dataset card
+        self.corpus_stats_path = os.path.splitext(self.data.dataset_path)[0] + ".stats.json"
         # Set POS tags
         self.noun_tags = ["NN","NNS","NNP","NNPS"]
         self.verb_tags = ["MD","VB","VBD","VBG","VBN","VBP","VBZ"]
         self.adjective_tags = ["JJ", "JJR", "JJS"]
         self.adverbs_tags = ["RB","RBR","RBS","WRB"]
+        # POS tags are grouped into integer categories (0 is used for other tags)
+        self.pos_categories = ["other", "nouns", "verbs", "adj", "adv"]
+        self.tag_categories = {}
+        for category, tags in enumerate([self.noun_tags, self.verb_tags, self.adjective_tags, self.adverbs_tags]):
+            for tag in tags:
+                self.tag_categories[tag] = category + 1
+        self.pos_categories_cache = [None for i in range(self.data.count_essays())]
+        # Versions of feature calculations. Increase the version when a calculation changes, so that saved datasets are updated
+        self.feature_versions = {
+            "chars"            : 1,
+            "words"            : 1,
+            "4sqrt_words"      : 1,
+            "avg_word_len"     : 1,
+            "words_gr5"        : 1,
+            "words_gr6"        : 1,
+            "words_gr7"        : 1,
+            "words_gr8"        : 1,
+            "diff_words"       : 1,
+            "long_words"       : 1,
+            "spell_err"        : 1,
+            "uniq_words"       : 1,
+            "nouns"            : 1,
+            "verbs"            : 1,
+            "adj"              : 1,
+            "adv"              : 1,
+            "stop_words"       : 1,
+            "sentences"        : 1,
+            "avg_sentence_len" : 1,
+            "exclamations"     : 1,
+            "questions"        : 1,
+            "commas"           : 1
+        }
+        # Features with fractional values (other features are counts)
+        self.float_features = {"4sqrt_words", "avg_word_len", "avg_sentence_len"}
+        # Group features by the data they are calculated from
+        self.char_features = {"chars", "exclamations", "questions", "commas"}
+        self.word_features = {"words", "4sqrt_words", "avg_word_len", "words_gr5", "words_gr6", "words_gr7", "words_gr8", "diff_words", "long_words", "spell_err", "uniq_words", "stop_words"}
+        self.pos_features = {"nouns", "verbs", "adj", "adv"}
+        self.sentence_features = {"sentences", "avg_sentence_len"}
         # Set feature descriptions
         self.feature_descriptions = {
             "chars"            : "Character Count",
@@ -68,43 +407,242 @@ class AESLinguisticFeatures:
             "commas"           : "Comma Count"
         }
 
+    @property
+    def spellcheck_dict(self):
+        """Shared enchant dictionary (loaded on first use)"""
+        return get_spellcheck_dict(self.spellcheck_language)
+
+    def __getstate__(self) -> dict:
+        """Only settings and the corpus statistics are pickled. Lexicons and the spellchecker are loaded again when unpickled (e.g. in worker processes)."""
+        return {
+            "data": self.data,
+            "difficult_words_path": self.difficult_words_path,
+            "stopwords_path": self.stopwords_path,
+            "token_cache_path": self.token_cache_path,
+            "total_average_word_length": self.total_average_word_length
+        }
+
+    def __setstate__(self, state: dict):
+        self.__init__(state["data"], state["difficult_words_path"], state["stopwords_path"], state["token_cache_path"])
+        self.total_average_word_length = state["total_average_word_length"]
+
+    def split_sentences(self, text: str) -> list:
+        """Split a text by sentences"""
+        from nltk.tokenize import sent_tokenize
+        with profiler.timer("features.sent_tokenize"):
+            return sent_tokenize(text)
+
+    def split_words(self, text: str) -> list:
+        """Split a text by words. Characters matching tokenize_filter are removed from words"""
+        from nltk.tokenize import word_tokenize
+        words = []
+        text = text.replace("/"," ")
+        text = text.replace("-"," ")
+        with profiler.timer("features.word_tokenize"):
+            tokens = word_tokenize(text)
+        for word in tokens:
+            if "@" in word:
+                word = word.lower()
+            word_clean = re.sub(self.tokenize_filter, '', word)
+            if len(word_clean) > 0:
+                words.append(word_clean)
+        return words
+
+    def tag_words(self, words: list) -> list:
+        """Get Part-Of-Speech tags of words"""
+        from nltk import pos_tag
+        with profiler.timer("features.pos_tag"):
+            return [tag for w, tag in pos_tag(words)]
+
     def tokenize_sentences(self, id: int) -> list:
-        """Tokenize essay by sentences"""
+        """Tokenize essay (id or AESEssay) by sentences"""
+        if isinstance(id, AESEssay):
+            if not "sentences" in id.cache:
+                id.cache["sentences"] = self.split_sentences(self.data.get_text(id))
+            return id.cache["sentences"]
         if len(self.sentence_cache[id]) > 0:
             return self.sentence_cache[id]
-        self.sentence_cache[id] = sent_tokenize(self.data.get_essay(id))
+        text = self.data.get_essay(id)
+        # Read from disk cache
+        spans = None if self.token_cache is None else self.token_cache.get_sentence_spans(id)
+        if spans is not None:
+            profiler.count("features.token_cache.sentences.hit")
+            self.sentence_cache[id] = [text[start:end] for start, end in spans]
+            return self.sentence_cache[id]
+        profiler.count("features.token_cache.sentences.miss")
+        self.sentence_cache[id] = self.split_sentences(text)
+        self.token_cache_changed = True
         return self.sentence_cache[id]
 
     def tokenize_words(self, id: int) -> list:
-        """Tokenize essay by words"""
+        """Tokenize essay (id or AESEssay) by words"""
+        if isinstance(id, AESEssay):
+            if not "words" in id.cache:
+                id.cache["words"] = self.split_words(self.data.get_text(id))
+            return id.cache["words"]
         if len(self.word_cache[id]) > 0:
             return self.word_cache[id]
-        self.word_cache[id] = []
-        text = self.data.get_essay(id)
-        text = text.replace("/"," ")
-        text = text.replace("-"," ")
-        for word in word_tokenize(text):
-            if "@" in word:
-                word = word.lower()
-            word_clean = re.sub(self.tokenize_filter, '', word)
-            if len(word_clean) > 0:
-                self.word_cache[id].append(word_clean)
+        # Read from disk cache
+        words = None if self.token_cache is None else self.token_cache.get_words(id)
+        if words is not None:
+            profiler.count("features.token_cache.words.hit")
+            self.word_cache[id] = words
+            return self.word_cache[id]
+        profiler.count("features.token_cache.words.miss")
+        self.token_cache_changed = True
+        self.word_cache[id] = self.split_words(self.data.get_essay(id))
         return self.word_cache[id]
 
     def get_pos_tags(self, id: int) -> int:
-        """Get Part-Of-Speech tags of an essay"""
+        """Get Part-Of-Speech tags of an essay (id or AESEssay)"""
+        if isinstance(id, AESEssay):
+            if not "pos_tags" in id.cache:
+                id.cache["pos_tags"] = self.tag_words(self.get_pos_words(id))
+            return id.cache["pos_tags"]
         if len(self.pos_tags_cache[id]) > 0:
             return self.pos_tags_cache[id]
+        # Read from disk cache
+        tags = None if self.token_cache is None else self.token_cache.get_pos_tags(id)
+        if tags is not None:
+            profiler.count("features.token_cache.pos_tags.hit")
+            self.pos_tags_cache[id] = tags
+            return self.pos_tags_cache[id]
+        profiler.count("features.token_cache.pos_tags.miss")
+        self.token_cache_changed = True
+        self.pos_tags_cache[id] = self.tag_words(self.get_pos_words(id))
+        return self.pos_tags_cache[id]
+
+    def get_pos_words(self, id: int) -> list:
+        """Get words of an essay that are tagged (all words except stop words)"""
         words = []
         for word in self.tokenize_words(id):
-            if not word.lower() in self.stopwords_list:
+            if not word.lower() in self.stopwords_lower:
                 words.append(word)
-        self.pos_tags_cache[id] = [tag for w, tag in pos_tag(words)]
-        return self.pos_tags_cache[id]
+        return words
+
+    def get_pos_categories(self, id: int) -> np.ndarray:
+        """Get Part-Of-Speech categories of an essay as an array of integer codes (indexes of pos_categories)"""
+        if isinstance(id, AESEssay):
+            if not "pos_categories" in id.cache:
+                id.cache["pos_categories"] = np.array([self.tag_categories.get(tag, 0) for tag in self.get_pos_tags(id)], dtype=np.uint8)
+            return id.cache["pos_categories"]
+        if self.pos_categories_cache[id] is not None:
+            return self.pos_categories_cache[id]
+        # Map tag codes from disk cache directly
+        codes = None
+        if len(self.pos_tags_cache[id]) == 0 and self.token_cache is not None:
+            codes = self.token_cache.get("pos_tags", id)
+        if codes is not None:
+            categories = np.array([self.tag_categories.get(tag, 0) for tag in self.token_cache.tags], dtype=np.uint8)[codes]
+        else:
+            categories = np.array([self.tag_categories.get(tag, 0) for tag in self.get_pos_tags(id)], dtype=np.uint8)
+        self.pos_categories_cache[id] = categories
+        return categories
+
+    def count_pos_categories(self, id: int) -> np.ndarray:
+        """Count words of each Part-Of-Speech category in an essay"""
+        return np.bincount(self.get_pos_categories(id), minlength=len(self.pos_categories))
+
+    def tag_essays(self, ids: list = None, batch_size: int = 1000, workers: int = 1):
+        """Tag Part-Of-Speech of many essays (ids or AESEssay objects) at once and fill the POS cache. All essays are tagged if ids are not specified.
+        Essays are tagged in batches of batch_size essays. If workers is greater than 1, batches are tagged in that many processes."""
+        if ids is None:
+            ids = range(self.data.count_essays())
+        ids = [id for id in ids if not self.is_tagged(id)]
+        if len(ids) == 0:
+            return
+        profiler.count("features.token_cache.pos_tags.miss", len(ids))
+        batches = [ids[i:i+batch_size] for i in range(0, len(ids), batch_size)]
+        if workers > 1:
+            with multiprocessing.get_context("spawn").Pool(workers, initializer=init_worker, initargs=(self,)) as pool:
+                for batch, results in zip(batches, pool.imap(tag_batch, batches)):
+                    for id, (words, tags) in zip(batch, results):
+                        self.set_tokens(id, words, tags)
+        else:
+            from nltk import pos_tag_sents
+            for batch in batches:
+                sentences = [self.get_pos_words(id) for id in batch]
+                with profiler.timer("features.pos_tag"):
+                    tagged = pos_tag_sents(sentences)
+                for id, sentence in zip(batch, tagged):
+                    self.set_tokens(id, self.tokenize_words(id), [tag for w, tag in sentence])
+        self.token_cache_changed = True
+
+    def is_tagged(self, id: int) -> bool:
+        """Check if POS tags of an essay (id or AESEssay) are cached in memory or on disk"""
+        if isinstance(id, AESEssay):
+            return "pos_tags" in id.cache
+        return len(self.pos_tags_cache[id]) > 0 or (self.token_cache is not None and self.token_cache.get("pos_tags", id) is not None)
+
+    def set_tokens(self, id: int, words: list, pos_tags: list):
+        """Save words and POS tags of an essay (id or AESEssay) to the cache"""
+        if isinstance(id, AESEssay):
+            id.cache["words"] = words
+            id.cache["pos_tags"] = pos_tags
+        else:
+            self.word_cache[id] = words
+            self.pos_tags_cache[id] = pos_tags
+
+    def get_word_lengths(self, id: int) -> np.ndarray:
+        """Get lengths of all words in an essay"""
+        if not isinstance(id, AESEssay) and len(self.word_cache[id]) == 0 and self.token_cache is not None:
+            lengths = self.token_cache.get_word_lengths(id)
+            if lengths is not None:
+                return lengths
+        words = self.tokenize_words(id)
+        return np.fromiter(map(len, words), dtype=np.int32, count=len(words))
+
+    def get_sentence_spans(self, id: int) -> list:
+        """Get (start, end) character spans of the essay's sentences. Returns None if sentences can not be located in the text"""
+        text = self.data.get_essay(id)
+        spans = []
+        position = 0
+        for sentence in self.sentence_cache[id]:
+            start = text.find(sentence, position)
+            if start < 0:
+                return None
+            position = start + len(sentence)
+            spans.append((start, position))
+        return spans
+
+    def get_new_tokens(self, id: int) -> tuple:
+        """Returns words, POS tags and sentences of an essay that were calculated by this instance and are not in the token cache yet
+        (None for each of them that was not calculated). Returns None if the token cache is disabled"""
+        if self.token_cache is None:
+            return None
+        words = self.word_cache[id] if len(self.word_cache[id]) > 0 and self.token_cache.get("words", id) is None else None
+        pos_tags = self.pos_tags_cache[id] if len(self.pos_tags_cache[id]) > 0 and self.token_cache.get("pos_tags", id) is None else None
+        sentences = self.sentence_cache[id] if len(self.sentence_cache[id]) > 0 and self.token_cache.get("sentences", id) is None else None
+        return words, pos_tags, sentences
+
+    def merge_tokens(self, id: int, words: list, pos_tags: list, sentences: list):
+        """Add words, POS tags and sentences calculated by a worker process to the cache (None values are skipped)"""
+        if words is not None:
+            self.word_cache[id] = words
+        if pos_tags is not None:
+            self.pos_tags_cache[id] = pos_tags
+        if sentences is not None:
+            self.sentence_cache[id] = sentences
+        if words is not None or pos_tags is not None or sentences is not None:
+            self.token_cache_changed = True
+
+    def save_token_cache(self):
+        """Save tokenized essays and POS tags to disk, so that the next runs start warm"""
+        if self.token_cache is None or not self.token_cache_changed:
+            return
+        words = []
+        pos_tags = []
+        sentence_spans = []
+        for id in range(self.data.count_essays()):
+            words.append(self.word_cache[id] if len(self.word_cache[id]) > 0 else self.token_cache.get_words(id))
+            pos_tags.append(self.pos_tags_cache[id] if len(self.pos_tags_cache[id]) > 0 else self.token_cache.get_pos_tags(id))
+            sentence_spans.append(self.get_sentence_spans(id) if len(self.sentence_cache[id]) > 0 else self.token_cache.get_sentence_spans(id))
+        self.token_cache.save(words, pos_tags, sentence_spans)
+        self.token_cache_changed = False
 
     def characters(self, id: int) -> int:
         """Count characters in an essay"""
-        return len(self.data.get_essay(id))
+        return len(self.data.get_text(id))
 
     def words(self, id: int) -> int:
         """Count words in an essay"""
@@ -115,9 +653,11 @@ class AESLinguisticFeatures:
         return self.words(id) ** (1/4)
 
     def average_word_length(self, id: int) -> float:
-        """Calculate average word length in an essay"""
+        """Calculate average word length in an essay (0 if it has no words)"""
         avg = 0
         words = self.tokenize_words(id)
+        if len(words) == 0:
+            return 0
         for word in words:
             avg += len(word)
         avg /= len(words)
@@ -139,18 +679,87 @@ class AESLinguisticFeatures:
                 count += 1
         return count
 
+    def get_dataset_signature(self) -> str:
+        """Get size and modification time of the dataset file (used to check that corpus statistics are current without reading essays)"""
+        stat = os.stat(self.data.p["path"])
+        return "{}-{}".format(stat.st_size, stat.st_mtime_ns)
+
+    def load_corpus_stats(self) -> dict:
+        """Load saved corpus statistics. Statistics calculated with other tokenization settings are discarded"""
+        settings = json.dumps([self.tokenize_filter, self.data.get_special_tokens(), self.data.p["alternative_tokens"]])
+        stats = {"settings": hashlib.sha1(settings.encode()).hexdigest(), "signature": "", "essays": 0, "chars": 0, "words": 0, "hashes": []}
+        if os.path.exists(self.corpus_stats_path):
+            with open(self.corpus_stats_path, "r") as f:
+                saved = json.loads(f.read())
+            f.close()
+            if saved.get("settings") == stats["settings"] and "hashes" in saved:
+                stats = saved
+        return stats
+
+    def is_corpus_stats_current(self, stats: dict) -> bool:
+        """Check that corpus statistics were calculated on the current dataset file"""
+        return stats["signature"] == self.get_dataset_signature() and stats["essays"] == self.data.count_essays()
+
+    def save_corpus_stats(self, stats: dict):
+        """Save corpus statistics next to the dataset card and use them"""
+        tmp_path = self.corpus_stats_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(stats))
+        f.close()
+        os.replace(tmp_path, self.corpus_stats_path)
+        self.total_average_word_length = stats["chars"] / stats["words"]
+
+    def precompute_corpus_stats(self, workers: int = 1, chunk_size: int = 64) -> dict:
+        """Calculate statistics of the whole dataset (used by long_words) and save them.
+        Hashes of essays are saved with the statistics. If the dataset file changed, only essays added to its end are processed,
+        unless other essays were edited, removed or reordered (then all essays are processed again).
+        Essays can be tokenized in several worker processes, chunk_size essays at a time (Optionally)."""
+        stats = self.load_corpus_stats()
+        if self.is_corpus_stats_current(stats):
+            self.total_average_word_length = stats["chars"] / stats["words"]
+            return stats
+        n = self.data.count_essays()
+        hashes = [self.get_essay_hash(id) for id in range(n)]
+        if stats["hashes"] != hashes[:stats["essays"]]:
+            stats.update({"essays": 0, "chars": 0, "words": 0, "hashes": []})
+        ids = list(range(stats["essays"], n))
+        if len(ids) > 0:
+            print("Calculating corpus statistics")
+        if workers > 1 and len(ids) > 0:
+            chunks = [ids[i:i+chunk_size] for i in range(0, len(ids), chunk_size)]
+            for chunk, chunk_results in zip(chunks, self.map_parallel(count_chunk, chunks, workers)):
+                for id, (chars, words, tokens) in zip(chunk, chunk_results):
+                    stats["chars"] += chars
+                    stats["words"] += words
+                    if tokens is not None:
+                        self.merge_tokens(id, *tokens)
+            # Workers of the next runs read the words from the token cache
+            self.save_token_cache()
+        else:
+            for id in ids:
+                stats["chars"] += self.characters(id)
+                stats["words"] += len(self.get_word_lengths(id))
+        stats["essays"] = n
+        stats["hashes"] = hashes
+        stats["signature"] = self.get_dataset_signature()
+        self.save_corpus_stats(stats)
+        return stats
+
+    def get_total_average_word_length(self) -> float:
+        """Get average word length in the whole dataset. Requires precompute_corpus_stats to be called once for the dataset (and again when it changes)"""
+        if self.total_average_word_length < 0:
+            stats = self.load_corpus_stats()
+            if not self.is_corpus_stats_current(stats):
+                raise ValueError("Corpus statistics are missing or outdated. Call precompute_corpus_stats() first")
+            self.total_average_word_length = stats["chars"] / stats["words"]
+        return self.total_average_word_length
+
     def long_words(self, id: int) -> int:
         """Count long words in an essay."""
-        if self.total_average_word_length < 0:
-            c = 0
-            w = 0
-            for i in range(self.data.count_essays()):
-                c += self.characters(i)
-                w += self.words(i)
-            self.total_average_word_length = c/w
+        total_average_word_length = self.get_total_average_word_length()
         count = 0
         for word in self.tokenize_words(id):
-            if len(word) > self.total_average_word_length:
+            if len(word) > total_average_word_length:
                 count += 1
         return count
 
@@ -158,7 +767,7 @@ class AESLinguisticFeatures:
         """Count spelling errors in an essay"""
         count = 0
         for word in self.tokenize_words(id):
-            if not self.spellcheck_dict.check(word) \
+            if not check_spelling(word, self.spellcheck_language) \
             and word != "th" \
             and word != "nt":
                 count += 1
@@ -166,50 +775,32 @@ class AESLinguisticFeatures:
 
     def unique_words(self, id: int) -> int:
         """Count unique words in an essay"""
-        unique = []
+        unique = set()
         for word in self.tokenize_words(id):
-            word_lower = word.lower()
-            if not word_lower in unique:
-                unique.append(word_lower)
+            unique.add(word.lower())
         return len(unique)
             
     def nouns(self, id: int) -> int :
         """Count nouns in an essay"""
-        count = 0
-        for tag in self.get_pos_tags(id):
-            if tag in self.noun_tags:
-                count += 1
-        return count
+        return int(np.count_nonzero(self.get_pos_categories(id) == 1))
 
     def verbs(self, id: int) -> int:
         """Count verbs in an essay"""
-        count = 0
-        for tag in self.get_pos_tags(id):
-            if tag in self.verb_tags:
-                count += 1
-        return count
+        return int(np.count_nonzero(self.get_pos_categories(id) == 2))
 
     def adjectives(self, id: int) -> int:
         """Count adjectives in an essay"""
-        count = 0
-        for tag in self.get_pos_tags(id):
-            if tag in self.adjective_tags:
-                count += 1
-        return count
+        return int(np.count_nonzero(self.get_pos_categories(id) == 3))
 
     def adverbs(self, id: int) -> int:
         """Count adverbs in an essay"""
-        count = 0
-        for tag in self.get_pos_tags(id):
-            if tag in self.adverbs_tags:
-                count += 1
-        return count
+        return int(np.count_nonzero(self.get_pos_categories(id) == 4))
 
     def stop_words(self, id: int) -> int:
         """Count stop words in an essay"""
         count = 0
         for word in self.tokenize_words(id):
-            if word.lower() in self.stopwords_list:
+            if word.lower() in self.stopwords_lower:
                 count += 1
         return count
 
@@ -218,9 +809,12 @@ class AESLinguisticFeatures:
         return len(self.tokenize_sentences(id))
 
     def average_sentence_length(self, id: int) -> int:
-        """Calculate average sentence length in an essay"""
+        """Calculate average sentence length in an essay (0 if it has no sentences)"""
         length = 0
         sentences = self.tokenize_sentences(id)
+        if len(sentences) == 0:
+            return 0
+        from nltk.tokenize import word_tokenize
         for sentence in sentences:
             length += len(word_tokenize(re.sub(self.tokenize_filter, '', sentence)))
         length /= len(sentences)
@@ -229,7 +823,7 @@ class AESLinguisticFeatures:
     def exclamation_marks(self, id: int) -> int:
         """Count exclamation marks in an essay"""
         count = 0
-        for c in self.data.get_essay(id):
+        for c in self.data.get_text(id):
             if c == "!":
                 count += 1
         return count
@@ -237,7 +831,7 @@ class AESLinguisticFeatures:
     def question_marks(self, id: int) -> int:
         """Count question marks in an essay"""
         count = 0
-        for c in self.data.get_essay(id):
+        for c in self.data.get_text(id):
             if c == "?":
                 count += 1
         return count
@@ -245,7 +839,7 @@ class AESLinguisticFeatures:
     def commas(self, id: int) -> int:
         """Count commas in an essay"""
         count = 0
-        for c in self.data.get_essay(id):
+        for c in self.data.get_text(id):
             if c == ",":
                 count += 1
         return count
@@ -255,32 +849,83 @@ class AESLinguisticFeatures:
         for key in self.feature_descriptions:
             print("{}: {}".format(key, self.feature_descriptions[key]))
 
-    def get_features(self, id: int, pretty = False) -> dict:
-        """Get all features of the essay as a single object. If pretty is set to true, feature descriptions will be used as keys"""
-        data = {
-            "chars"            : self.characters(id),
-            "words"            : self.words(id),
-            "4sqrt_words"      : self.fourth_root_of_word_count(id),
-            "avg_word_len"     : self.average_word_length(id),
-            "words_gr5"        : self.words_greater_n(id, 5),
-            "words_gr6"        : self.words_greater_n(id, 6),
-            "words_gr7"        : self.words_greater_n(id, 7),
-            "words_gr8"        : self.words_greater_n(id, 8),
-            "diff_words"       : self.difficult_words(id),
-            "long_words"       : self.long_words(id),
-            "spell_err"        : self.spelling_errors(id),
-            "uniq_words"       : self.unique_words(id),
-            "nouns"            : self.nouns(id),
-            "verbs"            : self.verbs(id),
-            "adj"              : self.adjectives(id),
-            "adv"              : self.adverbs(id),
-            "stop_words"       : self.stop_words(id),
-            "sentences"        : self.sentences(id),
-            "avg_sentence_len" : self.average_sentence_length(id),
-            "exclamations"     : self.exclamation_marks(id),
-            "questions"        : self.question_marks(id),
-            "commas"           : self.commas(id)
-        }
+    def extract_features(self, id: int, features: set) -> dict:
+        """Calculate the specified features of an essay in a single pass over its characters, words, POS tags and sentences.
+        Data that is not needed for the specified features is not processed."""
+        values = {}
+        # Characters
+        if not features.isdisjoint(self.char_features):
+            text = self.data.get_text(id)
+            chars = Counter(text)
+            values["chars"] = len(text)
+            values["exclamations"] = chars["!"]
+            values["questions"] = chars["?"]
+            values["commas"] = chars[","]
+        # Words
+        if not features.isdisjoint(self.word_features):
+            words = self.tokenize_words(id)
+            count_difficult = "diff_words" in features
+            count_long = "long_words" in features
+            count_errors = "spell_err" in features
+            count_lower = "uniq_words" in features or "stop_words" in features
+            if count_long:
+                total_average_word_length = self.get_total_average_word_length()
+            length = gr5 = gr6 = gr7 = gr8 = difficult = long = errors = stop = 0
+            unique = set()
+            for word in words:
+                n = len(word)
+                length += n
+                if n > 5:
+                    gr5 += 1
+                    if n > 6:
+                        gr6 += 1
+                        if n > 7:
+                            gr7 += 1
+                            if n > 8:
+                                gr8 += 1
+                if count_difficult and word in self.difficult_words_list:
+                    difficult += 1
+                if count_long and n > total_average_word_length:
+                    long += 1
+                if count_errors and not check_spelling(word, self.spellcheck_language) and word != "th" and word != "nt":
+                    errors += 1
+                if count_lower:
+                    word_lower = word.lower()
+                    unique.add(word_lower)
+                    if word_lower in self.stopwords_lower:
+                        stop += 1
+            values["words"] = len(words)
+            values["4sqrt_words"] = len(words) ** (1/4)
+            if "avg_word_len" in features:
+                values["avg_word_len"] = length / len(words) if len(words) > 0 else 0
+            values["words_gr5"] = gr5
+            values["words_gr6"] = gr6
+            values["words_gr7"] = gr7
+            values["words_gr8"] = gr8
+            values["diff_words"] = difficult
+            values["long_words"] = long
+            values["spell_err"] = errors
+            values["uniq_words"] = len(unique)
+            values["stop_words"] = stop
+        # Part-Of-Speech tags
+        if not features.isdisjoint(self.pos_features):
+            counts = self.count_pos_categories(id)
+            for category in range(1, len(self.pos_categories)):
+                values[self.pos_categories[category]] = int(counts[category])
+        # Sentences
+        if not features.isdisjoint(self.sentence_features):
+            values["sentences"] = self.sentences(id)
+            if "avg_sentence_len" in features:
+                values["avg_sentence_len"] = self.average_sentence_length(id)
+        return values
+
+    def get_features(self, id: int, pretty = False, blacklist_features: list = []) -> dict:
+        """Get all features of the essay (id or AESEssay) as a single object. If pretty is set to true, feature descriptions will be used as keys.
+        Features from blacklist_features are not calculated (Optionally)."""
+        features = [key for key in self.feature_descriptions if not key in blacklist_features]
+        with profiler.timer("features.extract_features"):
+            values = self.extract_features(id, set(features))
+        data = {key: values[key] for key in features}
         if not pretty:
             return data
         else:
@@ -289,6 +934,68 @@ class AESLinguisticFeatures:
                 pretty_data[self.feature_descriptions[key]] = data[key]
             return pretty_data
     
+    def featurize(self, texts: list, prompt: int = -1, blacklist_features: list = []) -> list:
+        """Get features of essays that are not part of the dataset (texts or AESEssay objects). 
+        Loaded lexicons, the spellchecker cache and corpus statistics are reused and all essays are tagged in one batch. Returns a list of feature dictionaries"""
+        essays = [text if isinstance(text, AESEssay) else AESEssay(text, prompt) for text in texts]
+        if not self.pos_features.isdisjoint(self.feature_descriptions.keys() - set(blacklist_features)):
+            self.tag_essays(essays)
+        return [self.get_features(essay, blacklist_features=blacklist_features) for essay in essays]
+
+    def feature_matrix(self, ids: list = None, features: list = None, as_frame: bool = False):
+        """Get features of many essays as a NumPy array with a row for each essay and a column for each feature.
+        All essays and all features are used if ids or features are not specified.
+        Features derived from characters and word lengths are calculated for all essays at once.
+        If as_frame is True, a pandas DataFrame with id, prompt and score columns (like in generate_dataset) is returned."""
+        if ids is None:
+            ids = list(range(self.data.count_essays()))
+        if features is None:
+            features = list(self.feature_descriptions.keys())
+        columns = {}
+        # Characters
+        if not self.char_features.isdisjoint(features):
+            texts = [self.data.get_text(id) for id in ids]
+            columns["chars"] = np.array([len(text) for text in texts])
+            columns["exclamations"] = np.array([text.count("!") for text in texts])
+            columns["questions"] = np.array([text.count("?") for text in texts])
+            columns["commas"] = np.array([text.count(",") for text in texts])
+        # Word lengths of all essays in one flat array
+        length_features = {"words", "4sqrt_words", "avg_word_len", "words_gr5", "words_gr6", "words_gr7", "words_gr8", "long_words"}
+        if not length_features.isdisjoint(features):
+            lengths = [self.get_word_lengths(id) for id in ids]
+            words = np.array([len(essay_lengths) for essay_lengths in lengths])
+            essays = np.repeat(np.arange(len(ids)), words)
+            lengths = np.concatenate(lengths) if len(lengths) > 0 else np.empty(0, dtype=np.int32)
+            columns["words"] = words
+            # Python's pow keeps the values identical to extract_features
+            columns["4sqrt_words"] = np.array([count ** (1/4) for count in words.tolist()], dtype=np.float64)
+            columns["avg_word_len"] = np.bincount(essays, weights=lengths, minlength=len(ids)) / np.maximum(words, 1)
+            for n in range(5, 9):
+                columns["words_gr{}".format(n)] = np.bincount(essays[lengths > n], minlength=len(ids))
+            if "long_words" in features:
+                columns["long_words"] = np.bincount(essays[lengths > self.get_total_average_word_length()], minlength=len(ids))
+        # Part-Of-Speech categories
+        if not self.pos_features.isdisjoint(features):
+            self.tag_essays(ids)
+            counts = np.array([self.count_pos_categories(id) for id in ids]).reshape(len(ids), len(self.pos_categories))
+            for category in range(1, len(self.pos_categories)):
+                columns[self.pos_categories[category]] = counts[:, category]
+        # Other features are calculated for each essay
+        remaining = set(features) - set(columns.keys())
+        if len(remaining) > 0:
+            values = [self.extract_features(id, remaining) for id in ids]
+            for key in remaining:
+                columns[key] = np.array([essay_values[key] for essay_values in values])
+        matrix = np.column_stack([columns[key] for key in features]).astype(np.float64) if len(features) > 0 else np.empty((len(ids), 0))
+        if not as_frame:
+            return matrix
+        import pandas as pd
+        frame = pd.DataFrame(matrix, columns=features)
+        frame.insert(0, "score", [self.data.get_score_norm(id) for id in ids])
+        frame.insert(0, "prompt", [self.data.get_prompt(id) for id in ids])
+        frame.insert(0, "id", ids)
+        return frame
+
     def print_features(self, id: int):
         """Output essay features to command line"""
         print("Essay {}:".format(id))
@@ -299,36 +1006,191 @@ class AESLinguisticFeatures:
                 fmt = "\t{}: {:.2f}"
             print(fmt.format(key, features[key]))
 
-    def generate_dataset(self, save_path: str = "", blacklist_features: list = [], column_names = True, normalize_scores = True):
-        """Generate dataset and save it in a csv file. 
+    def map_parallel(self, function, chunks: list, workers: int):
+        """Run a worker function on chunks in worker processes. Yields results of each chunk in order as soon as they are ready"""
+        with multiprocessing.get_context("spawn").Pool(workers, initializer=init_worker, initargs=(self,)) as pool:
+            for chunk_results in pool.imap(function, chunks):
+                yield chunk_results
+
+    def iter_features(self, requests: list):
+        """Calculate features of essays. Requests are (id, features) pairs. Yields (id, feature dictionary) in order of requests"""
+        for i, (id, features) in enumerate(requests):
+            print("{}/{}".format(i+1, len(requests)))
+            with profiler.timer("features.extract_features"):
+                values = self.extract_features(id, set(features))
+            yield id, {key: values[key] for key in features}
+
+    def iter_features_parallel(self, requests: list, workers: int, chunk_size: int):
+        """Calculate features of essays in worker processes, chunk_size essays at a time. Requests are (id, features) pairs.
+        Yields (id, feature dictionary) in order of requests as soon as the chunk of the essay is done. Corpus statistics are calculated first if long_words is requested"""
+        if self.total_average_word_length < 0 and any(["long_words" in features for id, features in requests]):
+            self.precompute_corpus_stats(workers, chunk_size)
+        chunks = [requests[i:i+chunk_size] for i in range(0, len(requests), chunk_size)]
+        done = 0
+        for chunk, chunk_results in zip(chunks, self.map_parallel(extract_chunk, chunks, workers)):
+            done += len(chunk)
+            print("{}/{}".format(done, len(requests)))
+            for (id, features), (values, tokens) in zip(chunk, chunk_results):
+                # Tokens calculated by workers are added to the token cache
+                if tokens is not None:
+                    self.merge_tokens(id, *tokens)
+                yield id, values
+
+    def extract_features_parallel(self, features: list, workers: int, chunk_size: int, ids: list = None) -> list:
+        """Calculate features of essays (all essays if ids are not specified) in worker processes. Returns feature dictionaries in order of ids"""
+        if ids is None:
+            ids = list(range(self.data.count_essays()))
+        return [values for id, values in self.iter_features_parallel([(id, features) for id in ids], workers, chunk_size)]
+
+    def get_feature_key(self, key: str) -> str:
+        """Get a hash of the feature version and all inputs of its calculation (None if an input is not known yet)"""
+        inputs = [key, self.feature_versions[key]]
+        if not key in self.char_features:
+            inputs.append(self.tokenize_filter)
+        if key == "diff_words":
+            inputs.append(self.difficult_words_hash)
+        if key == "stop_words" or key in self.pos_features:
+            inputs.append(self.stopwords_hash)
+        if key in self.pos_features or key in self.sentence_features:
+            inputs.append(get_nltk_version())
+        if key == "spell_err":
+            inputs.append(self.spellcheck_language)
+        if key == "long_words":
+            if self.total_average_word_length < 0:
+                return None
+            inputs.append(self.total_average_word_length)
+        return hashlib.sha1(json.dumps(inputs).encode()).hexdigest()[:16]
+
+    def get_essay_hash(self, id: int) -> str:
+        """Get a hash of the essay text"""
+        return hashlib.sha1(self.data.get_essay(id).encode()).hexdigest()[:16]
+
+    def load_previous_dataset(self, save_path: str, features: list) -> tuple:
+        """Load a dataset saved by generate_dataset and its metadata. 
+        Returns columns of features that are still valid and a row number for each essay hash (empty if nothing can be reused)"""
+        meta_path = save_path + ".meta.json"
+        if not os.path.exists(save_path) or not os.path.exists(meta_path):
+            return {}, {}
+        with open(meta_path, "r") as f:
+            meta = json.loads(f.read())
+        f.close()
+        if meta.get("dataset") != self.data.get_dataset_id():
+            return {}, {}
+        valid = [key for key in features if key in meta["features"] and meta["features"][key] is not None and meta["features"][key] == self.get_feature_key(key)]
+        if len(valid) == 0:
+            return {}, {}
+        frame = load_features_dataset(save_path)
+        if len(frame) != len(meta["rows"]):
+            return {}, {}
+        columns = {key: frame[key].tolist() for key in valid}
+        rows = {row_hash: row for row, row_hash in enumerate(meta["rows"])}
+        return columns, rows
+
+    def generate_dataset(self, save_path: str = "", blacklist_features: list = [], column_names = True, normalize_scores = True, workers: int = 1, chunk_size: int = 64, row_group_size: int = 1000, incremental: bool = True):
+        """Generate dataset and save it in a csv, Parquet, Feather or npz file (selected by the save_path extension). 
         Some features can be blacklisted (Optionally). 
-        Column names can be disabled (Optionally).
-        Score normalization can be disabled (Optionally)."""
+        Column names can be disabled for csv files (Optionally).
+        Score normalization can be disabled (Optionally).
+        Essays can be processed in several worker processes, chunk_size essays at a time (Optionally).
+        Rows are written to the file in groups of row_group_size essays.
+        If incremental is True and save_path was generated before, only new or changed essays and features with changed versions or lexicons are calculated."""
         print("Generating linguistic features dataset")
         data = []
+        features = [key for key in self.feature_descriptions if not key in blacklist_features]
         # Add header
         if column_names:
-            header = ["id","prompt","score"]
-            for key in self.feature_descriptions.keys():
-                if not key in blacklist_features:
-                    header.append(key)
-            data.append(header)
-        # Add data
+            data.append(["id","prompt","score"] + features)
+        # Calculate or load corpus statistics
+        if "long_words" in features:
+            self.precompute_corpus_stats(workers, chunk_size)
+        # Open dataset file (the file is replaced when all rows are written)
+        writer = None
+        if save_path != "":
+            dtypes = ["int64", "int64", "float64" if normalize_scores else "int64"] + ["float64" if key in self.float_features else "int64" for key in features]
+            meta = {
+                "dataset": self.data.get_dataset_id(),
+                "normalize_scores": normalize_scores,
+                "features": {key: self.feature_descriptions[key] for key in features}
+            }
+            writer = AESFeatureWriter(save_path, ["id","prompt","score"] + features, dtypes, meta, column_names, row_group_size)
+        # Find saved features that can be reused
+        hashes = [self.get_essay_hash(id) for id in range(self.data.count_essays())]
+        columns, rows = {}, {}
+        if writer is not None and incremental and (column_names or writer.format != ".csv"):
+            columns, rows = self.load_previous_dataset(writer.path, features)
+        previous = [rows.get(row_hash, -1) for row_hash in hashes]
+        invalid = [key for key in features if not key in columns]
+        new_ids = [id for id in range(self.data.count_essays()) if previous[id] < 0]
+        old_ids = [id for id in range(self.data.count_essays()) if previous[id] >= 0] if len(invalid) > 0 else []
+        print("Calculating {} features of {} essays and {} features of {} essays".format(len(features), len(new_ids), len(invalid), len(old_ids)))
+        # Features of new essays and invalid features of old essays are calculated in order of ids
+        requests = [(id, features if previous[id] < 0 else invalid) for id in sorted(new_ids + old_ids)]
+        if workers > 1:
+            results = self.iter_features_parallel(requests, workers, chunk_size)
+        else:
+            # Tag all essays in batches
+            if not self.pos_features.isdisjoint(invalid):
+                self.tag_essays(new_ids + old_ids)
+            elif not self.pos_features.isdisjoint(features):
+                self.tag_essays(new_ids)
+            results = self.iter_features(requests)
+        # Add data. Each row is written as soon as its features are calculated
+        result = next(results, None)
         for id in range(self.data.count_essays()):
-            print("{}/{}".format(id+1, self.data.count_essays()))
             prompt = self.data.get_prompt(id)
-            score = self.data.get_score_norm(id)
-            features = self.get_features(id)
+            score = self.data.get_score_norm(id) if normalize_scores else self.data.get_score(id)
             item = [id,prompt,score]
+            values = {}
+            if result is not None and result[0] == id:
+                values = result[1]
+                result = next(results, None)
             for key in features:
-                if not key in blacklist_features:
-                    item.append(features[key])
+                if key in values:
+                    item.append(values[key])
+                else:
+                    item.append(columns[key][previous[id]])
             data.append(item)
-        # Save data
-        if save_path != "":
-            with open(save_path, "w") as f:
-                for item in data:
-                    f.write(",".join([str(value) for value in item])+"\n")
-                f.close()
+            if writer is not None:
+                writer.write(item)
+        # Save data and versions of features
+        if writer is not None:
+            writer.close()
+            profiler.count("features.dataset.bytes_written", os.path.getsize(writer.path))
+            meta = {
+                "dataset": self.data.get_dataset_id(),
+                "features": {key: self.get_feature_key(key) for key in features},
+                "rows": hashes
+            }
+            with open(writer.path + ".meta.json", "w") as f:
+                f.write(json.dumps(meta))
+            f.close()
+        self.save_token_cache()
         return data
 
+# Features instance of a worker process
+worker_features = None
+
+def init_worker(features: AESLinguisticFeatures):
+    """Initializes a worker process of the parallel dataset generator"""
+    global worker_features
+    worker_features = features
+
+def tag_batch(ids: list) -> list:
+    """Tags Part-Of-Speech of a batch of essays in a worker process. Returns (words, tags) for each essay"""
+    from nltk import pos_tag_sents
+    tagged = pos_tag_sents([worker_features.get_pos_words(id) for id in ids])
+    return [(worker_features.tokenize_words(id), [tag for w, tag in sentence]) for id, sentence in zip(ids, tagged)]
+
+def count_chunk(ids: list) -> list:
+    """Counts characters and words of a chunk of essays in a worker process (used by corpus statistics).
+    Returns (character count, word count, new tokens) for each essay"""
+    return [(worker_features.characters(id), len(worker_features.get_word_lengths(id)), worker_features.get_new_tokens(id)) for id in ids]
+
+def extract_chunk(requests: list) -> list:
+    """Calculates features of a chunk of essays in a worker process. Requests are (id, features) pairs.
+    Returns (features, new tokens) for each essay. New tokens (words, POS tags and sentences that were not in the token cache) are returned, so that the parent process can save them."""
+    results = []
+    for id, features in requests:
+        values = worker_features.extract_features(id, set(features))
+        results.append(({key: values[key] for key in features}, worker_features.get_new_tokens(id)))
+    return results
@@ -0,0 +1,135 @@
+#!.env/bin/python
+from AESData import AESData
+from AESProfiler import profiler
+import numpy as np
+
+def confusion_kappa(confusion: np.ndarray) -> np.ndarray:
+    """Quadratic weighted kappa of confusion matrices (last two axes are true and predicted labels). NaN if kappa is not defined"""
+    n = confusion.shape[-1]
+    confusion = confusion.astype(np.float64)
+    sum_true = confusion.sum(axis=-1)
+    sum_pred = confusion.sum(axis=-2)
+    expected = sum_pred[..., :, None] * sum_true[..., None, :] / sum_true.sum(axis=-1)[..., None, None]
+    weights = (np.arange(n)[:, None] - np.arange(n)[None, :]) ** 2
+    observed = np.sum(weights * confusion, axis=(-2, -1))
+    denominator = np.sum(weights * expected, axis=(-2, -1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, 1 - observed / denominator, np.nan)
+
+def get_label_indices(y_true, y_pred, labels: list = None) -> tuple:
+    """Get labels and indices of ratings in labels. Ratings that are not in labels are removed"""
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    if labels is None:
+        labels, indices = np.unique(np.concatenate([y_true, y_pred]), return_inverse=True)
+        return labels, indices[:len(y_true)], indices[len(y_true):]
+    labels = np.sort(np.asarray(labels))
+    true_indices = np.minimum(np.searchsorted(labels, y_true), len(labels) - 1)
+    pred_indices = np.minimum(np.searchsorted(labels, y_pred), len(labels) - 1)
+    valid = (labels[true_indices] == y_true) & (labels[pred_indices] == y_pred)
+    return labels, true_indices[valid], pred_indices[valid]
+
+def quadratic_weighted_kappa(y_true, y_pred, labels: list = None) -> float:
+    """Quadratic weighted Cohen's kappa of two arrays of integer ratings (same as cohen_kappa_score(weights="quadratic") of scikit-learn).
+    Labels are all ratings that occur in y_true or y_pred if not specified, ratings that are not in labels are ignored."""
+    labels, true_indices, pred_indices = get_label_indices(y_true, y_pred, labels)
+    n = len(labels)
+    confusion = np.bincount(true_indices * n + pred_indices, minlength=n * n).reshape(n, n)
+    return float(confusion_kappa(confusion))
+
+def bootstrap_kappa(y_true, y_pred, labels: list = None, resamples: int = 1000, seed: int = 0, chunk_size: int = 1 << 22) -> np.ndarray:
+    """Quadratic weighted kappa of bootstrap resamples of essays. Confusion matrices of many resamples are counted at once,
+    chunk_size limits the number of resampled essays in memory."""
+    labels, true_indices, pred_indices = get_label_indices(y_true, y_pred, labels)
+    n = len(labels)
+    pairs = true_indices * n + pred_indices
+    rng = np.random.default_rng(seed)
+    kappas = np.empty(resamples, dtype=np.float64)
+    if len(pairs) == 0:
+        kappas.fill(np.nan)
+        return kappas
+    step = max(chunk_size // len(pairs), 1)
+    with profiler.timer("metrics.bootstrap"):
+        for start in range(0, resamples, step):
+            count = min(step, resamples - start)
+            samples = pairs[rng.integers(0, len(pairs), size=(count, len(pairs)))]
+            samples += (np.arange(count) * n * n)[:, None]
+            confusion = np.bincount(samples.ravel(), minlength=count * n * n).reshape(count, n, n)
+            kappas[start:start+count] = confusion_kappa(confusion)
+    return kappas
+
+def mean_kappa(kappas, weights: list = None) -> np.ndarray:
+    """Average kappas of prompts (last axis) using Fisher's z transformation, as in the ASAP competition"""
+    kappas = np.clip(np.asarray(kappas, dtype=np.float64), -0.999, 0.999)
+    if weights is None:
+        weights = np.ones(kappas.shape[-1])
+    weights = np.asarray(weights, dtype=np.float64) / np.sum(weights)
+    return np.tanh(np.sum(np.arctanh(kappas) * weights, axis=-1))
+
+class AESMetrics:
+    """Evaluation metrics on scales of prompts of a dataset"""
+
+    def __init__(self, data: AESData):
+        """Constructor. Min and max scores of prompts are read from the dataset card"""
+        self.data = data
+        self.min_scores = np.array([data.get_prompt_min_score(prompt) for prompt in range(1, data.count_prompts()+1)], dtype=np.float64)
+        self.max_scores = np.array([data.get_prompt_max_score(prompt) for prompt in range(1, data.count_prompts()+1)], dtype=np.float64)
+
+    def get_labels(self, prompt: int) -> np.ndarray:
+        """Get all allowed scores of the prompt"""
+        return np.arange(int(self.min_scores[prompt-1]), int(self.max_scores[prompt-1])+1)
+
+    def to_native(self, scores_norm, prompts) -> np.ndarray:
+        """Convert normalized scores (e.g. predictions) to integer scores on the scale of each prompt. Scores are rounded and clipped to the allowed range"""
+        indices = np.asarray(prompts) - 1
+        min_scores, max_scores = self.min_scores[indices], self.max_scores[indices]
+        scores = np.rint(min_scores + np.asarray(scores_norm, dtype=np.float64) * (max_scores - min_scores))
+        return np.clip(scores, min_scores, max_scores).astype(np.int64)
+
+    def to_norm(self, scores, prompts) -> np.ndarray:
+        """Convert scores on the scale of each prompt to normalized scores (0-1) like AESData.get_score_norm"""
+        indices = np.asarray(prompts) - 1
+        return (np.asarray(scores) - self.min_scores[indices]) / (self.max_scores - self.min_scores)[indices]
+
+    def kappa(self, y_true, y_pred, prompts, normalized: bool = True) -> dict:
+        """Quadratic weighted kappa of each prompt on its scale and overall kappa (mean of prompts).
+        Scores are normalized (0-1) unless normalized is False"""
+        return self.bootstrap(y_true, y_pred, prompts, 0, normalized=normalized)
+
+    def bootstrap(self, y_true, y_pred, prompts, resamples: int = 1000, confidence: float = 0.95, seed: int = 0, normalized: bool = True) -> dict:
+        """Quadratic weighted kappa of each prompt and overall with bootstrap confidence intervals.
+        Essays are resampled within each prompt and overall kappa is calculated for each resample"""
+        prompts = np.asarray(prompts)
+        if normalized:
+            y_true = self.to_native(y_true, prompts)
+            y_pred = self.to_native(y_pred, prompts)
+        y_true = np.asarray(y_true)
+        y_pred = np.asarray(y_pred)
+        keys = [int(prompt) for prompt in np.unique(prompts)]
+        results = {"prompts": {}}
+        samples = []
+        for i, prompt in enumerate(keys):
+            rows = np.flatnonzero(prompts == prompt)
+            labels = self.get_labels(prompt)
+            results["prompts"][prompt] = {"essays": len(rows), "qwk": quadratic_weighted_kappa(y_true[rows], y_pred[rows], labels)}
+            if resamples > 0:
+                samples.append(bootstrap_kappa(y_true[rows], y_pred[rows], labels, resamples, seed + i))
+                results["prompts"][prompt]["ci"] = self.get_interval(samples[-1], confidence)
+        results["overall"] = {"essays": len(prompts), "qwk": float(mean_kappa([results["prompts"][prompt]["qwk"] for prompt in keys]))}
+        if resamples > 0:
+            results["overall"]["ci"] = self.get_interval(mean_kappa(np.stack(samples, axis=-1)), confidence)
+        return results
+
+    def get_interval(self, samples: np.ndarray, confidence: float) -> list:
+        """Get percentile confidence interval of bootstrap samples"""
+        alpha = (1 - confidence) / 2
+        return [float(value) for value in np.nanpercentile(samples, [alpha * 100, (1 - alpha) * 100])]
+
+    def print_kappa(self, results: dict):
+        """Output kappa of prompts and overall to command line"""
+        rows = [("Prompt {}".format(prompt), result) for prompt, result in results["prompts"].items()] + [("Overall", results["overall"])]
+        for name, result in rows:
+            line = "{}: QWK {:.4f} ({} essays)".format(name, result["qwk"], result["essays"])
+            if "ci" in result:
+                line += ", CI [{:.4f}, {:.4f}]".format(*result["ci"])
+            print(line)
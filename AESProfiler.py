@@ -0,0 +1,103 @@
+import json
+import time
+
+class AESTimer:
+    """Context manager that adds the time spent in a block to a profiler timer"""
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+class AESNullTimer:
+    """Context manager that does nothing (used when the profiler is disabled)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class AESProfiler:
+    """Opt-in instrumentation of AES Tools. Collects time spent in stages (timers) and counters
+    (cache hits and misses, bytes read and written). Only the current process is measured."""
+
+    def __init__(self, enabled: bool = False):
+        """Constructor. The profiler does not collect anything until it is enabled"""
+        self.enabled = enabled
+        self.null_timer = AESNullTimer()
+        self.reset()
+
+    def enable(self):
+        """Start collecting statistics"""
+        self.enabled = True
+
+    def disable(self):
+        """Stop collecting statistics. Collected statistics are kept"""
+        self.enabled = False
+
+    def reset(self):
+        """Remove collected statistics"""
+        self.timers = {}
+        self.counters = {}
+
+    def timer(self, name: str):
+        """Get a context manager that measures the time spent in a block under the name"""
+        if not self.enabled:
+            return self.null_timer
+        return AESTimer(self, name)
+
+    def add_time(self, name: str, seconds: float):
+        """Add a measured call to a timer"""
+        if not name in self.timers:
+            self.timers[name] = [0, 0.0]
+        self.timers[name][0] += 1
+        self.timers[name][1] += seconds
+
+    def count(self, name: str, value: int = 1):
+        """Increase a counter"""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_time(self, name: str) -> float:
+        """Get total seconds of a timer"""
+        return self.timers[name][1] if name in self.timers else 0.0
+
+    def get_count(self, name: str) -> int:
+        """Get value of a counter"""
+        return self.counters.get(name, 0)
+
+    def get_stats(self) -> dict:
+        """Get all timers and counters"""
+        return {
+            "timers": {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in sorted(self.timers.items())},
+            "counters": dict(sorted(self.counters.items()))
+        }
+
+    def to_json(self, path: str = "") -> str:
+        """Export statistics as JSON. If path is specified, they are saved to a file as well"""
+        output = json.dumps(self.get_stats(), indent=4)
+        if path != "":
+            with open(path, "w") as f:
+                f.write(output)
+            f.close()
+        return output
+
+    def print_stats(self):
+        """Output statistics to command line"""
+        print("Timers:")
+        for name, (calls, seconds) in sorted(self.timers.items(), key=lambda item: -item[1][1]):
+            print("\t{}: {:.4f} s ({} calls)".format(name, seconds, calls))
+        print("Counters:")
+        for name, value in sorted(self.counters.items()):
+            print("\t{}: {}".format(name, value))
+
+# Profiler shared by all classes
+profiler = AESProfiler()
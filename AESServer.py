@@ -0,0 +1,404 @@
+#!.env/bin/python
+"""Local scoring service. Models, lexicons and the trained regressor are loaded once and
+concurrent requests are scored together in micro-batches.
+
+Start the server (HTTP on localhost or a Unix socket):
+    python AESServer.py serve --dataset datasets/ASAP.json --regressor linguistic_features.pkl --port 8080
+    python AESServer.py serve --dataset datasets/ASAP.json --regressor linguistic_features.pkl --unix /tmp/aes.sock
+Send essays of the dataset to a running server and report latency:
+    python AESServer.py bench --dataset datasets/ASAP.json --port 8080 --requests 200 --concurrency 16
+
+Endpoints:
+    POST /score   {"essays": [{"text": "...", "prompt": 1}, ...]} or {"text": "...", "prompt": 1}
+    GET  /stats   latency percentiles, throughput and batch sizes
+    GET  /health
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import signal
+import time
+import numpy as np
+from AESData import AESData, AESEssay
+from AESMetrics import AESMetrics
+from AESProfiler import profiler
+
+class AESScorer:
+    """Scores essays with a trained regressor using linguistic features (and optionally embeddings appended after them)"""
+
+    def __init__(self, dataset_path: str, regressor_path: str, blacklist_features: list = [], embeddings_model: str = "", total_average_word_length: float = -1):
+        """Constructor. Requires a dataset card (special tokens, prompts and corpus statistics) and a pickled regressor with a predict method.
+        If the regressor was fitted on a DataFrame, its feature names select the features.
+        The average word length of the corpus can be passed if it was calculated by another process, otherwise corpus statistics are loaded or calculated."""
+        from AESLinguisticFeatures import AESLinguisticFeatures
+        self.data = AESData(dataset_path, lazy=True)
+        self.features = AESLinguisticFeatures(self.data, token_cache_path="")
+        self.metrics = AESMetrics(self.data)
+        with open(regressor_path, "rb") as f:
+            self.regressor = pickle.load(f)
+        f.close()
+        if hasattr(self.regressor, "feature_names_in_"):
+            self.feature_names = [key for key in self.regressor.feature_names_in_ if key in self.features.feature_descriptions]
+        else:
+            self.feature_names = [key for key in self.features.feature_descriptions if not key in blacklist_features]
+        if total_average_word_length >= 0:
+            self.features.total_average_word_length = total_average_word_length
+        elif "long_words" in self.feature_names:
+            self.features.precompute_corpus_stats()
+        self.embeddings = None
+        if embeddings_model != "":
+            from AESEmbeddings import AESEmbeddings
+            self.embeddings = AESEmbeddings(self.data, model_name=embeddings_model)
+            self.embeddings.load_model()
+
+    def score(self, essays: list) -> list:
+        """Score essays given as (text, prompt) pairs. Returns normalized scores and scores on the prompt's scale (if the prompt is known)"""
+        essays = [AESEssay(text, prompt) for text, prompt in essays]
+        x = self.features.feature_matrix(essays, self.feature_names)
+        if self.embeddings is not None:
+            x = np.hstack([x, self.embeddings.featurize(essays)])
+        if hasattr(self.regressor, "feature_names_in_") and len(self.regressor.feature_names_in_) == x.shape[1]:
+            import pandas as pd
+            x = pd.DataFrame(x, columns=self.regressor.feature_names_in_)
+        predictions = np.asarray(self.regressor.predict(x), dtype=np.float64)
+        # Convert scores of essays with a known prompt at once
+        prompts = np.array([essay.prompt for essay in essays])
+        known = prompts > 0
+        prompt_scores = np.zeros(len(essays), dtype=np.int64)
+        prompt_scores[known] = self.metrics.to_native(predictions[known], prompts[known])
+        results = []
+        for essay, score, prompt_score in zip(essays, predictions.tolist(), prompt_scores.tolist()):
+            result = {"score": score}
+            if essay.prompt > 0:
+                result["prompt_score"] = prompt_score
+            results.append(result)
+        return results
+
+# Scorer of a worker process (or of the server process if it has no workers)
+worker_scorer = None
+
+def init_worker(config: dict):
+    """Initializes a scoring worker process"""
+    global worker_scorer
+    worker_scorer = AESScorer(**config)
+
+def get_total_average_word_length(config: dict) -> float:
+    """Loads or calculates corpus statistics once in the server process, so that worker processes do not calculate and save them at the same time.
+    Returns -1 if the regressor does not use long_words"""
+    config = {key: value for key, value in config.items() if key != "embeddings_model"}
+    return AESScorer(**config).features.total_average_word_length
+
+def score_batch(essays: list) -> list:
+    """Scores a batch of essays with the scorer of the current process"""
+    return worker_scorer.score(essays)
+
+def ping() -> bool:
+    """Used to start worker processes before the first request"""
+    return worker_scorer is not None
+
+class AESServer:
+    """Asyncio HTTP server that collects concurrent requests into micro-batches.
+    A batch is scored when it has max_batch_size essays or when its first request waited max_wait seconds."""
+
+    def __init__(self, config: dict, workers: int = 0, max_batch_size: int = 32, max_wait: float = 0.01):
+        """Constructor. config contains AESScorer arguments. With workers > 0 batches are scored in that many processes
+        (each with its own scorer), otherwise in a thread of the server process."""
+        self.config = config
+        self.workers = workers
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = None
+        self.queue = None
+        self.slots = None
+        self.tasks = set()
+        self.prompts = 0
+        # Statistics
+        self.latencies = collections.deque(maxlen=10000)
+        self.batch_sizes = collections.deque(maxlen=10000)
+        self.requests = 0
+        self.essays = 0
+        self.errors = 0
+        self.started = time.time()
+
+    def start_workers(self):
+        """Load the scorer once in every worker (or in the server process)"""
+        global worker_scorer
+        print("Loading scorer...")
+        if self.workers > 0:
+            # Workers only receive the corpus statistics
+            config = dict(self.config)
+            config["total_average_word_length"] = get_total_average_word_length(self.config)
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker, initargs=(config,))
+            for ready in [self.executor.submit(ping) for i in range(self.workers)]:
+                ready.result()
+        else:
+            worker_scorer = AESScorer(**self.config)
+            self.executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    async def submit(self, essays: list) -> list:
+        """Queue essays for the next batch and wait for their scores"""
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((essays, future))
+        results = await future
+        self.latencies.append(time.perf_counter() - start)
+        self.requests += 1
+        self.essays += len(essays)
+        return results
+
+    async def batcher(self):
+        """Collect queued requests into batches and score them in the worker pool"""
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            count = len(items[0][0])
+            deadline = loop.time() + self.max_wait
+            while count < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                count += len(items[-1][0])
+            # Limit the number of batches in flight to the number of workers
+            await self.slots.acquire()
+            task = asyncio.ensure_future(self.run_batch(items))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, items: list):
+        """Score a batch and pass results to the waiting requests.
+        If the batch fails, its requests are scored one by one, so that only the failing request gets an error"""
+        try:
+            essays = [essay for item_essays, future in items for essay in item_essays]
+            self.batch_sizes.append(len(essays))
+            try:
+                with profiler.timer("server.batch"):
+                    results = await asyncio.get_running_loop().run_in_executor(self.executor, score_batch, essays)
+            except Exception:
+                if len(items) == 1:
+                    raise
+                results = None
+            if results is not None:
+                offset = 0
+                for item_essays, future in items:
+                    future.set_result(results[offset:offset+len(item_essays)])
+                    offset += len(item_essays)
+            else:
+                for item_essays, future in items:
+                    try:
+                        future.set_result(await asyncio.get_running_loop().run_in_executor(self.executor, score_batch, item_essays))
+                    except Exception as e:
+                        self.errors += 1
+                        future.set_exception(e)
+        except Exception as e:
+            self.errors += 1
+            for item_essays, future in items:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    def get_stats(self) -> dict:
+        """Get latency percentiles (in milliseconds), throughput and batch sizes"""
+        latencies = np.array(self.latencies) * 1000
+        uptime = time.time() - self.started
+        return {
+            "requests": self.requests,
+            "essays": self.essays,
+            "errors": self.errors,
+            "batches": len(self.batch_sizes),
+            "avg_batch_size": float(np.mean(self.batch_sizes)) if len(self.batch_sizes) > 0 else 0.0,
+            "latency_ms": {
+                "p50": float(np.percentile(latencies, 50)) if len(latencies) > 0 else 0.0,
+                "p99": float(np.percentile(latencies, 99)) if len(latencies) > 0 else 0.0,
+                "mean": float(latencies.mean()) if len(latencies) > 0 else 0.0
+            },
+            "throughput": {
+                "requests_per_second": self.requests / uptime,
+                "essays_per_second": self.essays / uptime
+            },
+            "uptime": uptime
+        }
+
+    def parse_essays(self, body: bytes) -> list:
+        """Read (text, prompt) pairs from a request body. Raises ValueError for invalid requests"""
+        request = json.loads(body.decode())
+        items = request["essays"] if "essays" in request else [request]
+        essays = []
+        for item in items:
+            if not isinstance(item.get("text"), str):
+                raise ValueError("Every essay requires a text")
+            # Texts without letters have no words to calculate features of
+            if re.search(r"[A-Za-z]", item["text"]) is None:
+                raise ValueError("Essay text has no words")
+            prompt = int(item.get("prompt", -1))
+            if prompt > self.prompts or prompt == 0:
+                raise ValueError("Unknown prompt: {}".format(prompt))
+            essays.append((item["text"], prompt))
+        if len(essays) == 0:
+            raise ValueError("No essays in request")
+        return essays
+
+    async def route(self, method: str, path: str, body: bytes) -> tuple:
+        """Handle a request. Returns HTTP status and a JSON response"""
+        if path == "/score" and method == "POST":
+            try:
+                essays = self.parse_essays(body)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                return 400, {"error": str(e)}
+            try:
+                return 200, {"results": await self.submit(essays)}
+            except Exception as e:
+                return 500, {"error": str(e)}
+        if path == "/stats" and method == "GET":
+            return 200, self.get_stats()
+        if path == "/health" and method == "GET":
+            return 200, {"status": "ok"}
+        return 404, {"error": "Not found"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve HTTP requests of a connection (keep-alive is supported)"""
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode().split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in [b"\r\n", b"\n", b""]:
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, response = await self.route(method, path, body)
+                payload = json.dumps(response).encode()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                    status, reasons[status], len(payload), "keep-alive" if keep_alive else "close").encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080, unix_path: str = ""):
+        """Load the scorer and serve requests until SIGINT or SIGTERM"""
+        self.start_workers()
+        self.prompts = AESData(self.config["dataset_path"], lazy=True).count_prompts()
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(max(self.workers, 1))
+        batcher = asyncio.ensure_future(self.batcher())
+        if unix_path != "":
+            server = await asyncio.start_unix_server(self.handle, path=unix_path)
+            print("Serving on {}".format(unix_path))
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            print("Serving on http://{}:{}".format(host, port))
+        self.started = time.time()
+        # Stop on signals
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for signal_number in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(signal_number, lambda: stop.done() or stop.set_result(None))
+        try:
+            async with server:
+                await stop
+        finally:
+            batcher.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            if unix_path != "" and os.path.exists(unix_path):
+                os.remove(unix_path)
+
+async def request(method: str, path: str, body: dict = None, host: str = "127.0.0.1", port: int = 8080, unix_path: str = "") -> tuple:
+    """Send a single HTTP request to the server. Returns status and the JSON response"""
+    if unix_path != "":
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    payload = b"" if body is None else json.dumps(body).encode()
+    writer.write("{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+        method, path, host, len(payload)).encode() + payload)
+    await writer.drain()
+    status = int((await reader.readline()).decode().split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in [b"\r\n", b"\n", b""]:
+            break
+        name, value = line.decode().split(":", 1)
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    response = json.loads((await reader.readexactly(length)).decode())
+    writer.close()
+    return status, response
+
+async def bench(dataset_path: str, requests: int, concurrency: int, host: str, port: int, unix_path: str):
+    """Send essays of a dataset to the server with concurrent clients and report client side latency"""
+    data = AESData(dataset_path, lazy=True)
+    essays = [{"text": data.get_essay(id, replace_special_tokens=False), "prompt": data.get_prompt(id)} for id in range(min(requests, data.count_essays()))]
+    latencies = []
+    async def client(worker: int):
+        for i in range(worker, requests, concurrency):
+            start = time.perf_counter()
+            status, response = await request("POST", "/score", essays[i % len(essays)], host, port, unix_path)
+            if status != 200:
+                print("Error {}: {}".format(status, response.get("error")))
+            latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    await asyncio.gather(*[client(worker) for worker in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    print("{} requests in {:.2f} s ({:.1f} requests/s)".format(requests, elapsed, requests / elapsed))
+    print("Latency: p50 {:.1f} ms, p99 {:.1f} ms".format(np.percentile(latencies, 50), np.percentile(latencies, 99)))
+    status, stats = await request("GET", "/stats", None, host, port, unix_path)
+    print("Server: {}".format(json.dumps(stats)))
+
+def main():
+    parser = argparse.ArgumentParser(description="AES scoring service")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="Start the server")
+    serve_parser.add_argument("--dataset", required=True, help="Dataset card (special tokens, prompts and corpus statistics)")
+    serve_parser.add_argument("--regressor", required=True, help="Pickled regressor trained on linguistic features")
+    serve_parser.add_argument("--blacklist", default="", help="Comma separated features the regressor was trained without")
+    serve_parser.add_argument("--embeddings-model", default="", help="Append embeddings of this BERT model to the features")
+    serve_parser.add_argument("--workers", type=int, default=0, help="Number of scoring processes (0 scores in the server process)")
+    serve_parser.add_argument("--max-batch-size", type=int, default=32, help="Maximum number of essays in a batch")
+    serve_parser.add_argument("--max-wait-ms", type=float, default=10, help="Maximum time a request waits for its batch to fill")
+    bench_parser = commands.add_parser("bench", help="Send essays of a dataset to a running server")
+    bench_parser.add_argument("--dataset", required=True)
+    bench_parser.add_argument("--requests", type=int, default=200)
+    bench_parser.add_argument("--concurrency", type=int, default=16)
+    for command_parser in [serve_parser, bench_parser]:
+        command_parser.add_argument("--host", default="127.0.0.1")
+        command_parser.add_argument("--port", type=int, default=8080)
+        command_parser.add_argument("--unix", default="", help="Use a Unix socket instead of TCP")
+    args = parser.parse_args()
+    if args.command == "serve":
+        config = {
+            "dataset_path": args.dataset,
+            "regressor_path": args.regressor,
+            "blacklist_features": [key for key in args.blacklist.split(",") if key != ""],
+            "embeddings_model": args.embeddings_model
+        }
+        server = AESServer(config, args.workers, args.max_batch_size, args.max_wait_ms / 1000)
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+        print(json.dumps(server.get_stats(), indent=4))
+    else:
+        asyncio.run(bench(args.dataset, args.requests, args.concurrency, args.host, args.port, args.unix))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#!.env/bin/python
+"""Benchmarks of the main code paths on a synthetic ASAP-shaped corpus.
+
+Run benchmarks and save timings:
+    python benchmark.py run --essays 2000 --output bench.json
+Compare two runs (exit code is 1 if a benchmark got slower than the threshold allows):
+    python benchmark.py compare old.json new.json --threshold 0.1
+
+Sections whose dependencies (NLTK data, enchant, torch, transformers) are missing are skipped.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+
+CARD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "datasets", "ASAP.json")
+WORDS = ["the", "a", "an", "and", "but", "because", "people", "computers", "technology", "believe", "think", "would", "could",
+    "should", "important", "community", "library", "books", "children", "parents", "school", "students", "teachers", "friends",
+    "family", "happy", "beautiful", "extraordinary", "reasonable", "dangerous", "environment", "experience", "opportunity",
+    "information", "communicate", "always", "never", "sometimes", "quickly", "really", "very", "many", "some", "every",
+    "time", "day", "world", "life", "home", "work", "play", "learn", "read", "write", "help", "make", "go", "see", "know",
+    "is", "are", "was", "were", "be", "have", "has", "had", "do", "does", "did", "in", "on", "at", "of", "to", "for", "with",
+    "from", "about", "that", "this", "these", "it", "they", "we", "i", "you", "he", "she", "becuase", "alot", "recieve", "thier"]
+SPECIAL_TOKENS = ["@CAPS", "@NUM", "@LOCATION", "@PERSON", "@DATE", "@ORGANIZATION"]
+
+def make_corpus(directory: str, essays: int, seed: int = 0) -> str:
+    """Generate a synthetic corpus with ASAP columns and prompts. Returns the path of its dataset card"""
+    rng = random.Random(seed)
+    with open(CARD_PATH, "r") as f:
+        card = json.loads(f.read())
+    f.close()
+    card["id"] = "synthetic-asap-{}-{}".format(essays, seed)
+    card["path"] = "synthetic.tsv"
+    with open(os.path.join(directory, "synthetic.tsv"), "w") as f:
+        f.write("\t".join(["essay_id", "essay_set", "essay", "rater1_domain1", "rater2_domain1", "rater3_domain1", "domain1_score"]) + "\n")
+        for id in range(essays):
+            prompt = card["prompts"][rng.randrange(len(card["prompts"]))]
+            sentences = []
+            for s in range(rng.randint(3, 25)):
+                words = []
+                for w in range(rng.randint(5, 20)):
+                    if rng.random() < 0.05:
+                        words.append("{}{}".format(rng.choice(SPECIAL_TOKENS), rng.randint(1, 9)))
+                    else:
+                        words.append(rng.choice(WORDS))
+                    if rng.random() < 0.05:
+                        words[-1] += ","
+                words[0] = words[0].capitalize()
+                sentences.append(" ".join(words) + rng.choice([".", ".", ".", "!", "?"]))
+            score = rng.randint(prompt["min_score"], prompt["max_score"])
+            f.write("\t".join([str(id), str(prompt["id"]), " ".join(sentences), str(score), str(score), "", str(score)]) + "\n")
+    f.close()
+    card_path = os.path.join(directory, "synthetic.json")
+    with open(card_path, "w") as f:
+        f.write(json.dumps(card))
+    f.close()
+    return card_path
+
+def make_tiny_model(directory: str, card_path: str) -> str:
+    """Build and save a tiny randomly initialized BERT model with a vocabulary of the synthetic corpus. Returns its path"""
+    import torch
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+    with open(card_path, "r") as f:
+        card = json.loads(f.read())
+    f.close()
+    words = sorted(set(WORDS + [word for token in card["alternative_tokens"] for word in token.split()] + [",", ".", "!", "?"]))
+    path = os.path.join(directory, "tiny-bert")
+    os.makedirs(path)
+    with open(os.path.join(path, "vocab.txt"), "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+    f.close()
+    tokenizer = BertTokenizerFast(os.path.join(path, "vocab.txt"), model_max_length=128)
+    tokenizer.save_pretrained(path)
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(words) + 5, hidden_size=64, num_hidden_layers=2, num_attention_heads=2, intermediate_size=128, max_position_embeddings=128)
+    BertModel(config).save_pretrained(path)
+    return path
+
+class Benchmark:
+    """Runs timed benchmarks and collects results"""
+
+    def __init__(self, repeat: int = 3, verbose: bool = False):
+        self.repeat = repeat
+        self.verbose = verbose
+        self.results = {}
+        self.skipped = {}
+
+    def run(self, name: str, function, items: int = 1, setup = None, repeat: int = -1):
+        """Time function (called with the result of setup, if specified) repeat times. Output of the function is hidden"""
+        times = []
+        for r in range(self.repeat if repeat == -1 else repeat):
+            with contextlib.redirect_stdout(io.StringIO()):
+                state = setup() if setup is not None else None
+                start = time.perf_counter()
+                function(state)
+                times.append(time.perf_counter() - start)
+        seconds = statistics.median(times)
+        self.results[name] = {
+            "seconds": seconds,
+            "min": min(times),
+            "repeat": len(times),
+            "items": items,
+            "items_per_second": items / seconds if seconds > 0 else None
+        }
+        if self.verbose:
+            print("{:<36} {:>10.4f} s {:>12.1f} items/s".format(name, seconds, items / seconds if seconds > 0 else 0), file=sys.stderr)
+
+    def skip(self, section: str, reason: str):
+        """Record a skipped section"""
+        self.skipped[section] = reason
+        if self.verbose:
+            print("{:<36} skipped: {}".format(section, reason), file=sys.stderr)
+
+def bench_data(bench: Benchmark, card_path: str):
+    """AESData construction, statistics and essay access"""
+    from AESData import AESData
+    data = AESData(card_path)
+    ids = list(range(data.count_essays()))
+    bench.run("data.load", lambda state: AESData(card_path), len(ids))
+    AESData(card_path, lazy=True)
+    bench.run("data.load_lazy", lambda state: AESData(card_path, lazy=True), len(ids))
+    bench.run("data.get_stats", lambda state: state.get_stats(), data.count_prompts(), setup=lambda: AESData(card_path))
+    bench.run("data.get_essay", lambda state: [state.get_essay(id) for id in ids], len(ids), setup=lambda: AESData(card_path, essay_cache_size=0))
+    bench.run("data.get_essay_lazy", lambda state: [state.get_essay(id) for id in ids], len(ids), setup=lambda: AESData(card_path, lazy=True, essay_cache_size=0))
+
+def bench_features(bench: Benchmark, card_path: str, directory: str):
+    """Tokenization, each linguistic feature, feature_matrix and generate_dataset"""
+    from AESData import AESData
+    from AESLinguisticFeatures import AESLinguisticFeatures
+    data = AESData(card_path)
+    ids = list(range(data.count_essays()))
+    difficult_words_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "difficult_words.txt")
+    new_features = lambda: AESLinguisticFeatures(data, difficult_words_path=difficult_words_path, token_cache_path="")
+    # Check that NLTK data and enchant are available
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            features = new_features()
+            features.tokenize_sentences(0)
+            features.get_pos_tags(0)
+            features.spelling_errors(0)
+    except (ImportError, LookupError, OSError) as e:
+        message = [line.strip() for line in str(e).split("\n") if line.strip("* ") != ""]
+        bench.skip("features", "{}: {}".format(type(e).__name__, message[0] if len(message) > 0 else ""))
+        return
+    bench.run("features.tokenize_words", lambda state: [state.tokenize_words(id) for id in ids], len(ids), setup=new_features)
+    bench.run("features.tokenize_sentences", lambda state: [state.tokenize_sentences(id) for id in ids], len(ids), setup=new_features)
+    bench.run("features.tag_essays", lambda state: state.tag_essays(), len(ids), setup=new_features)
+    bench.run("features.precompute_corpus_stats", lambda state: state.precompute_corpus_stats(), len(ids), setup=new_features, repeat=1)
+    # Each feature with tokenized and tagged essays
+    features = new_features()
+    with contextlib.redirect_stdout(io.StringIO()):
+        features.precompute_corpus_stats()
+        features.tag_essays()
+        for id in ids:
+            features.tokenize_sentences(id)
+    for key in features.feature_descriptions:
+        bench.run("feature.{}".format(key), lambda state: [features.extract_features(id, {key}) for id in ids], len(ids))
+    bench.run("features.extract_all", lambda state: [features.extract_features(id, set(features.feature_descriptions)) for id in ids], len(ids))
+    # End to end with empty caches
+    bench.run("features.feature_matrix", lambda state: state.feature_matrix(), len(ids), setup=new_features)
+    save_path = os.path.join(directory, "features.csv")
+    bench.run("features.generate_dataset", lambda state: state.generate_dataset(save_path, incremental=False), len(ids), setup=new_features)
+
+def bench_embeddings(bench: Benchmark, card_path: str, directory: str, essays: int):
+    """Encoding with a tiny BERT model and reading cached embeddings"""
+    try:
+        import torch
+        import transformers
+    except ImportError as e:
+        bench.skip("embeddings", "ImportError: {}".format(e))
+        return
+    from AESData import AESData
+    from AESEmbeddings import AESEmbeddings
+    with contextlib.redirect_stdout(io.StringIO()):
+        model_path = make_tiny_model(directory, card_path)
+    data = AESData(card_path)
+    ids = list(range(min(essays, data.count_essays())))
+    cache_path = os.path.join(directory, "cached_embeddings")
+    def new_embeddings():
+        embeddings = AESEmbeddings(data, model_name=model_path, num_threads=1)
+        embeddings.cache_path = cache_path
+        return embeddings
+    def loaded_embeddings():
+        embeddings = new_embeddings()
+        embeddings.load_model()
+        return embeddings
+    def empty_cache():
+        shutil.rmtree(cache_path, ignore_errors=True)
+        return loaded_embeddings()
+    bench.run("embeddings.load_model", lambda state: state.load_model(), 1, setup=new_embeddings)
+    bench.run("embeddings.encode", lambda state: state.encode_essays(ids), len(ids), setup=loaded_embeddings)
+    bench.run("embeddings.cache_all_data", lambda state: state.cache_all_data(), data.count_essays(), setup=empty_cache, repeat=1)
+    bench.run("embeddings.cache_read", lambda state: [state.get_embeddings(id) for id in range(data.count_essays())], data.count_essays(), setup=new_embeddings)
+    bench.run("embeddings.get_all_embeddings", lambda state: state.get_all_embeddings(), data.count_essays(), setup=new_embeddings)
+
+def run(args) -> dict:
+    """Run benchmarks of selected sections and return the report"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    directory = tempfile.mkdtemp(prefix="aes-benchmark-")
+    bench = Benchmark(args.repeat, verbose=True)
+    sections = args.sections.split(",")
+    try:
+        card_path = make_corpus(directory, args.essays, args.seed)
+        if "data" in sections:
+            bench_data(bench, card_path)
+        if "features" in sections:
+            bench_features(bench, card_path, directory)
+        if "embeddings" in sections:
+            bench_embeddings(bench, card_path, directory, args.embedding_essays)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "essays": args.essays,
+            "embedding_essays": args.embedding_essays,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count()
+        },
+        "results": bench.results,
+        "skipped": bench.skipped
+    }
+
+def compare(old: dict, new: dict, threshold: float, min_difference: float = 0.001) -> list:
+    """Print timings of two runs side by side. Returns names of benchmarks that are slower by more than threshold (relative)
+    and by more than min_difference seconds (so that noise of very fast benchmarks is not reported)"""
+    for key in ["essays", "embedding_essays"]:
+        if old["meta"].get(key) != new["meta"].get(key):
+            print("Warning! Runs use different {}: {} and {}".format(key, old["meta"].get(key), new["meta"].get(key)))
+    regressions = []
+    print("{:<36} {:>10} {:>10} {:>8}".format("benchmark", "old (s)", "new (s)", "change"))
+    for name in new["results"]:
+        if not name in old["results"]:
+            print("{:<36} {:>10} {:>10.4f} {:>8}".format(name, "-", new["results"][name]["seconds"], "new"))
+            continue
+        old_seconds = old["results"][name]["seconds"]
+        new_seconds = new["results"][name]["seconds"]
+        change = new_seconds / old_seconds - 1 if old_seconds > 0 else 0
+        flag = ""
+        if change > threshold and new_seconds - old_seconds > min_difference:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif change < -threshold and old_seconds - new_seconds > min_difference:
+            flag = "faster"
+        print("{:<36} {:>10.4f} {:>10.4f} {:>+7.1%} {}".format(name, old_seconds, new_seconds, change, flag))
+    for name in old["results"]:
+        if not name in new["results"]:
+            print("{:<36} {:>10.4f} {:>10} {:>8}".format(name, old["results"][name]["seconds"], "-", "missing"))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of AES Tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run benchmarks")
+    run_parser.add_argument("--essays", type=int, default=2000, help="Number of essays in the synthetic corpus")
+    run_parser.add_argument("--embedding-essays", type=int, default=200, help="Number of essays encoded by the embeddings benchmarks")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Number of repetitions (the median is reported)")
+    run_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpus")
+    run_parser.add_argument("--sections", default="data,features,embeddings", help="Comma separated sections to run")
+    run_parser.add_argument("--output", default="", help="Save results to a JSON file")
+    compare_parser = commands.add_parser("compare", help="Compare two saved runs")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown reported as a regression")
+    compare_parser.add_argument("--min-difference", type=float, default=0.001, help="Smallest slowdown in seconds reported as a regression")
+    args = parser.parse_args()
+    if args.command == "run":
+        report = run(args)
+        if args.output != "":
+            with open(args.output, "w") as f:
+                f.write(json.dumps(report, indent=4))
+            f.close()
+        else:
+            print(json.dumps(report, indent=4))
+    else:
+        with open(args.old, "r") as f:
+            old = json.loads(f.read())
+        f.close()
+        with open(args.new, "r") as f:
+            new = json.loads(f.read())
+        f.close()
+        regressions = compare(old, new, args.threshold, args.min_difference)
+        if len(regressions) > 0:
+            print("{} regression(s): {}".format(len(regressions), ", ".join(regressions)))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 #!.env/bin/python
 from AESData import AESData
+from AESMetrics import quadratic_weighted_kappa
 from nltk.translate.bleu_score import sentence_bleu
-from sklearn.metrics import cohen_kappa_score
+import numpy as np
 
 # It is completely useless
 
@@ -17,7 +18,7 @@ prompt = 1
 references = []
 for id in d.get_prompt_essays(prompt):
     if d.get_score(id) == d.get_prompt_max_score(prompt):
-        references = d.get_essay_as_arr(id)
+        references = d.get_essay_arr(id)
         break
 
 # Choose random essay as a template
@@ -25,7 +26,7 @@ for id in d.get_prompt_essays(prompt):
 original_scores = []
 predicted_scores = []
 for id in d.get_prompt_essays(prompt):
-    candidates = d.get_essay_as_arr(id)
+    candidates = d.get_essay_arr(id)
     if candidates == references:
         continue
     predicted_score = 0
@@ -38,5 +39,5 @@ for id in d.get_prompt_essays(prompt):
     original_scores.append(original_score)
     predicted_scores.append(predicted_score)
 
-qwk = cohen_kappa_score(original_scores, predicted_scores, labels=None, weights="quadratic", sample_weight=None)
+qwk = quadratic_weighted_kappa(np.array(original_scores), np.array(predicted_scores))
 print("QWK: {qwk}".format(qwk = qwk))
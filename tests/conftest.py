@@ -0,0 +1,39 @@
+import json
+import os
+import sys
+import pytest
+
+# Modules of AES Tools are in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def write_dataset(directory, rows: list, newline: str = "\n", header: bool = True) -> str:
+    """Write a small dataset with ASAP columns and its card. Returns path of the card"""
+    lines = ["essay_id\tessay_set\tessay\tr1\tr2\tr3\tdomain1_score"] if header else []
+    for i, (prompt, text, score) in enumerate(rows):
+        lines.append("{}\t{}\t{}\t0\t0\t0\t{}".format(i, prompt, text, score))
+    with open(os.path.join(directory, "data.tsv"), "w", newline="") as f:
+        f.write(newline.join(lines) + (newline if len(lines) > 0 else ""))
+    f.close()
+    card = {
+        "id": "test",
+        "path": "data.tsv",
+        "skip_first_line": header,
+        "columns": {"prompt": 1, "essay": 2, "score": 6},
+        "special_tokens": ["@CAPS", "@NUM"],
+        "alternative_tokens": ["capital", "some"],
+        "prompts": [{"min_score": 0, "max_score": 4, "genre": "test"}, {"min_score": 1, "max_score": 6, "genre": "test"}]
+    }
+    path = os.path.join(directory, "data.json")
+    with open(path, "w") as f:
+        f.write(json.dumps(card))
+    f.close()
+    return path
+
+@pytest.fixture
+def rows() -> list:
+    return [
+        (1, "The first essay. It has @CAPS1 two sentences.", 3),
+        (2, "A second essay with @NUM2 words!", 5),
+        (1, "Third essay without a special token.", 0),
+        (2, "Last essay.", 6)
+    ]
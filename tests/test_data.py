@@ -0,0 +1,47 @@
+import pytest
+from AESData import AESData
+from conftest import write_dataset
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n", "\r"])
+def test_lazy_and_eager_rows_are_identical(tmp_path, rows, newline):
+    path = write_dataset(tmp_path, rows, newline)
+    eager = AESData(path)
+    lazy = AESData(path, lazy=True)
+    assert lazy.count_essays() == eager.count_essays() == len(rows)
+    assert lazy.prompts.tolist() == eager.prompts.tolist() == [prompt for prompt, text, score in rows]
+    assert lazy.scores.tolist() == eager.scores.tolist() == [score for prompt, text, score in rows]
+    for id in range(len(rows)):
+        assert lazy.get_essay(id) == eager.get_essay(id)
+        assert lazy.get_essay(id, replace_special_tokens=False) == rows[id][1]
+        assert lazy.get_column(id, 6) == eager.get_column(id, 6)
+    # Index saved by the first lazy instance is reused
+    assert AESData(path, lazy=True).offsets.tolist() == lazy.offsets.tolist()
+
+def test_last_row_without_newline(tmp_path, rows):
+    path = write_dataset(tmp_path, rows)
+    with open(tmp_path / "data.tsv", "rb+") as f:
+        f.truncate(f.seek(0, 2) - 1)
+    f.close()
+    eager = AESData(path)
+    lazy = AESData(path, lazy=True)
+    assert [lazy.get_essay(id) for id in range(len(rows))] == [eager.get_essay(id) for id in range(len(rows))]
+
+def test_special_tokens_are_replaced(tmp_path, rows):
+    data = AESData(write_dataset(tmp_path, rows), lazy=True)
+    assert data.get_essay(0) == "The first essay. It has capital two sentences."
+    assert data.get_essay(1) == "A second essay with some words!"
+    assert data.get_score_norm(1) == pytest.approx(0.8)
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_empty_dataset(tmp_path, lazy):
+    path = write_dataset(tmp_path, [], header=False)
+    data = AESData(path, lazy=lazy)
+    assert data.count_essays() == 0
+    assert data.get_prompt_essays(1) == []
+
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize("prompt", [0, 3])
+def test_unknown_prompt(tmp_path, rows, lazy, prompt):
+    rows[2] = (prompt, rows[2][1], rows[2][2])
+    with pytest.raises(ValueError, match="Unknown prompt {} of essay 2".format(prompt)):
+        AESData(write_dataset(str(tmp_path), rows), lazy=lazy)
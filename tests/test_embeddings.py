@@ -0,0 +1,102 @@
+import multiprocessing
+import numpy as np
+import os
+import pytest
+from conftest import write_dataset
+from AESData import AESData
+from AESEmbeddings import AESEmbeddingStore, AESEmbeddings
+
+def vectors(start: int, count: int, dim: int = 8) -> np.ndarray:
+    return np.arange(start * dim, (start + count) * dim, dtype=np.float32).reshape(count, dim) / 1000
+
+def write_keys(args: tuple):
+    path, prefix, batches = args
+    store = AESEmbeddingStore(path)
+    for i in range(batches):
+        store.put_many(["{}{}".format(prefix, i * 10 + j) for j in range(10)], vectors(i * 10, 10))
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_store_survives_two_writers_and_regrow(tmp_path, dtype):
+    path = str(tmp_path / "embeddings")
+    first = AESEmbeddingStore(path, dtype)
+    second = AESEmbeddingStore(path, dtype)
+    first.put_many(["a{}".format(i) for i in range(1000)], vectors(0, 1000))
+    # The second writer has not seen rows of the first one and its matrix is replaced by a larger one
+    second.put_many(["b{}".format(i) for i in range(100)], vectors(1000, 100))
+    first.put_many(["a{}".format(i) for i in range(1000, 1100)], vectors(1100, 100))
+    tolerance = 0.01 if dtype == "int8" else 0
+    for store in [first, second, AESEmbeddingStore(path, dtype)]:
+        assert "b0" in store and "a1099" in store
+        assert np.allclose(store.get_matrix(["a{}".format(i) for i in range(1100)]), np.vstack([vectors(0, 1000), vectors(1100, 100)]), atol=tolerance)
+        assert np.allclose(store.get_matrix(["b{}".format(i) for i in range(100)]), vectors(1000, 100), atol=tolerance)
+    assert len(AESEmbeddingStore(path, dtype)) == 1200
+
+def test_store_processes_write_concurrently(tmp_path):
+    path = str(tmp_path / "embeddings")
+    with multiprocessing.get_context("spawn").Pool(2) as pool:
+        pool.map(write_keys, [(path, "a", 60), (path, "b", 60)])
+    store = AESEmbeddingStore(path)
+    assert len(store) == 1200
+    for prefix in ["a", "b"]:
+        assert np.array_equal(store.get_matrix(["{}{}".format(prefix, i) for i in range(600)]), vectors(0, 600))
+
+def test_store_ignores_interrupted_key_write(tmp_path):
+    path = str(tmp_path / "embeddings")
+    AESEmbeddingStore(path).put_many(["a", "b"], vectors(0, 2))
+    with open(path + ".keys", "ab") as f:
+        f.write(b"unfinished")
+    f.close()
+    store = AESEmbeddingStore(path)
+    assert store.keys() == ["a", "b"]
+    store.put("c", vectors(2, 1)[0])
+    assert AESEmbeddingStore(path).keys() == ["a", "b", "c"]
+
+def test_cache_key_follows_local_model_files(tmp_path):
+    model = tmp_path / "model"
+    model.mkdir()
+    (model / "config.json").write_text("{}")
+    key = AESEmbeddings(None, model_name=str(model)).get_cache_key("An essay.")
+    assert AESEmbeddings(None, model_name=str(model)).get_cache_key("An essay.") == key
+    (model / "config.json").write_text('{"hidden_size": 8}')
+    assert AESEmbeddings(None, model_name=str(model)).get_cache_key("An essay.") != key
+
+def test_finished_run_removes_progress(tmp_path, rows):
+    model = tmp_path / "model"
+    model.mkdir()
+    (model / "config.json").write_text("{}")
+    data = AESData(write_dataset(str(tmp_path), rows))
+    embeddings = AESEmbeddings(data, model_name=str(model))
+    embeddings.cache_path = str(tmp_path / "cache")
+    keys = [embeddings.get_cache_key(data.get_essay(id)) for id in range(data.count_essays())]
+    embeddings.get_store().put_many(keys, vectors(0, len(keys)))
+    # Progress left by an interrupted run, all essays were cached since
+    progress_path = embeddings.get_store().path + ".progress"
+    with open(progress_path, "w") as f:
+        f.write(keys[0] + "\n")
+    f.close()
+    embeddings.cache_all_data()
+    assert not os.path.exists(progress_path)
+
+def test_commit_of_downloaded_model_without_hub(tmp_path, monkeypatch):
+    import huggingface_hub
+    from huggingface_hub import constants
+    commit = "0123456789abcdef0123456789abcdef01234567"
+    model = tmp_path / "models--org--model"
+    (model / "refs").mkdir(parents=True)
+    (model / "refs" / "main").write_text(commit)
+    (model / "snapshots" / commit).mkdir(parents=True)
+    (model / "snapshots" / commit / "config.json").write_text("{}")
+    monkeypatch.setattr(constants, "HF_HUB_CACHE", str(tmp_path))
+    # The Hub must not be asked for a downloaded model
+    requests = []
+    def model_info(*args, **kwargs):
+        requests.append(args)
+        raise ConnectionError("offline")
+    monkeypatch.setattr(huggingface_hub, "model_info", model_info)
+    embeddings = AESEmbeddings(None, model_name="org/model")
+    assert embeddings.get_commit("org/model") == commit
+    assert embeddings.get_load_revision("org/model") == commit
+    assert requests == []
+    # A pinned commit is used as it is
+    pinned = "f" * 40
+    assert AESEmbeddings(None, model_name="org/model", revision=pinned).get_commit("org/model") == pinned
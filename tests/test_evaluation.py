@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from AESEvaluation import AESEvaluation
+from AESMetrics import quadratic_weighted_kappa
+
+def get_dataset(essays: int = 60) -> pd.DataFrame:
+    """Features dataset of three prompts where the score depends on the features"""
+    rng = np.random.default_rng(0)
+    x = rng.random((essays * 3, 3))
+    score = np.clip(x @ [0.5, 0.3, 0.1] + rng.normal(0, 0.05, len(x)), 0, 1)
+    return pd.DataFrame({"id": np.arange(len(x)), "prompt": np.repeat([1, 2, 3], essays), "score": score, "chars": x[:, 0], "words": x[:, 1], "commas": x[:, 2]})
+
+def test_evaluate_split(tmp_path):
+    from sklearn.linear_model import LinearRegression
+    dataset = get_dataset()
+    evaluation = AESEvaluation(dataset, cache_path=str(tmp_path))
+    evaluation.add_split("train", [1, 2], [3])
+    evaluation.add_feature_set("chars", ["chars"])
+    results = evaluation.evaluate()
+    assert results[["split", "features", "prompt"]].values.tolist() == [["train", "all", 3], ["train", "chars", 3]]
+    # Same as fitting the model directly
+    train = dataset[dataset["prompt"] != 3]
+    test = dataset[dataset["prompt"] == 3]
+    for features, row in [(["chars", "words", "commas"], 0), (["chars"], 1)]:
+        predictions = LinearRegression().fit(train[features], train["score"]).predict(test[features])
+        for scale in [100, 10]:
+            expected = quadratic_weighted_kappa(np.rint(test["score"].to_numpy() * scale).astype(np.int64), np.rint(predictions * scale).astype(np.int64))
+            assert results["qwk_{}".format(scale)][row] == pytest.approx(expected)
+    # Fitted models are reused from cache_path
+    assert len(os.listdir(str(tmp_path))) == 2
+    cached = AESEvaluation(dataset, cache_path=str(tmp_path))
+    cached.add_split("train", [1, 2], [3])
+    cached.add_feature_set("chars", ["chars"])
+    cached.fit = None
+    assert cached.evaluate().equals(results)
+
+def test_evaluate_in_workers():
+    evaluation = AESEvaluation(get_dataset())
+    evaluation.add_leave_one_prompt_out()
+    evaluation.add_ablation_feature_sets()
+    results = evaluation.evaluate(workers=2)
+    assert len(results) == 3 * 4
+    serial = AESEvaluation(get_dataset())
+    serial.add_leave_one_prompt_out()
+    serial.add_ablation_feature_sets()
+    pd.testing.assert_frame_equal(serial.evaluate(), results)
+
+def test_unknown_split_inputs():
+    evaluation = AESEvaluation(get_dataset())
+    with pytest.raises(ValueError):
+        evaluation.add_split("train", [1, 4], [3])
+    with pytest.raises(ValueError):
+        evaluation.add_feature_set("unknown", ["sentences"])
+    with pytest.raises(ValueError):
+        evaluation.evaluate()
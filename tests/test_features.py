@@ -0,0 +1,123 @@
+import os
+import pytest
+from conftest import write_dataset
+from AESData import AESData
+from AESLinguisticFeatures import AESLinguisticFeatures, AESTokenCache
+
+def save_cache(path: str, data: AESData):
+    """Save words of all essays (split by spaces) to a token cache"""
+    cache = AESTokenCache(path, data)
+    words = [data.get_essay(id).split(" ") for id in range(data.count_essays())]
+    cache.save(words, [["NN"] * len(essay) for essay in words], [[(0, 1)] for essay in words])
+
+def test_token_cache_round_trip(tmp_path, rows):
+    data = AESData(write_dataset(str(tmp_path), rows))
+    path = os.path.join(str(tmp_path), "tokens.npz")
+    save_cache(path, data)
+    cache = AESTokenCache(path, data)
+    for id in range(data.count_essays()):
+        assert cache.get_words(id) == data.get_essay(id).split(" ")
+        assert cache.get_sentence_spans(id) == [[0, 1]]
+
+def test_token_cache_skips_edited_essays(tmp_path, rows):
+    path = os.path.join(str(tmp_path), "tokens.npz")
+    save_cache(path, AESData(write_dataset(str(tmp_path), rows)))
+    # Edit the second essay, swap the last two and append a new one
+    edited = [rows[0], (2, "An edited essay.", 5), rows[3], rows[2], (1, "A new essay.", 2)]
+    data = AESData(write_dataset(str(tmp_path), edited))
+    cache = AESTokenCache(path, data)
+    assert cache.get_words(0) == data.get_essay(0).split(" ")
+    for id in range(1, 5):
+        assert cache.get_words(id) is None
+        assert cache.get_pos_tags(id) is None
+        assert cache.get_sentence_spans(id) is None
+
+def test_token_cache_of_fewer_essays(tmp_path, rows):
+    path = os.path.join(str(tmp_path), "tokens.npz")
+    save_cache(path, AESData(write_dataset(str(tmp_path), rows)))
+    data = AESData(write_dataset(str(tmp_path), rows[:2]))
+    cache = AESTokenCache(path, data)
+    assert [cache.get_words(id) for id in range(2)] == [data.get_essay(id).split(" ") for id in range(2)]
+
+def get_features(directory: str, rows: list = None) -> AESLinguisticFeatures:
+    """Features of a dataset (written again if rows are specified). Words are split by spaces, so that NLTK is not needed.
+    Tokenized texts are counted in features.tokenized"""
+    if rows is not None:
+        write_dataset(directory, rows)
+    data = AESData(os.path.join(directory, "data.json"))
+    stopwords_path = os.path.join(directory, "stopwords.txt")
+    with open(stopwords_path, "w") as f:
+        f.write("the\na")
+    f.close()
+    features = AESLinguisticFeatures(data, difficult_words_path="", stopwords_path=stopwords_path, token_cache_path="")
+    features.tokenized = 0
+    def split_words(text: str) -> list:
+        features.tokenized += 1
+        return [word for word in text.split(" ") if word != ""]
+    features.split_words = split_words
+    return features
+
+def get_average_word_length(features: AESLinguisticFeatures) -> float:
+    words = [word for id in range(features.data.count_essays()) for word in features.data.get_essay(id).split(" ")]
+    return sum([len(features.data.get_text(id)) for id in range(features.data.count_essays())]) / len(words)
+
+def test_corpus_stats_are_required(tmp_path, rows):
+    features = get_features(str(tmp_path), rows)
+    with pytest.raises(ValueError, match="precompute_corpus_stats"):
+        features.long_words(0)
+    assert features.tokenized == 0
+    get_features(str(tmp_path)).precompute_corpus_stats()
+    # Saved statistics are used without reading essays
+    features = get_features(str(tmp_path))
+    features.data.get_essay = None
+    assert features.get_total_average_word_length() == get_average_word_length(get_features(str(tmp_path)))
+    assert features.tokenized == 0
+
+def test_corpus_stats_of_edited_essays(tmp_path, rows):
+    get_features(str(tmp_path), rows).precompute_corpus_stats()
+    features = get_features(str(tmp_path), [rows[0], (2, "An edited essay that is longer than before.", 5)] + rows[2:])
+    with pytest.raises(ValueError):
+        features.get_total_average_word_length()
+    features.precompute_corpus_stats()
+    assert features.tokenized == len(rows)
+    assert features.get_total_average_word_length() == get_average_word_length(features)
+
+def test_corpus_stats_of_appended_essays(tmp_path, rows):
+    get_features(str(tmp_path), rows).precompute_corpus_stats()
+    features = get_features(str(tmp_path), rows + [(1, "A new essay.", 2)])
+    with pytest.raises(ValueError):
+        features.get_total_average_word_length()
+    features.precompute_corpus_stats()
+    assert features.tokenized == 1
+    assert features.get_total_average_word_length() == get_average_word_length(features)
+
+def generate_dataset(features: AESLinguisticFeatures, path: str) -> list:
+    """Generate a dataset of features that do not need NLTK or a spellchecker"""
+    blacklist = list(features.pos_features | features.sentence_features | {"spell_err"})
+    return features.generate_dataset(path, blacklist_features=blacklist, normalize_scores=False)
+
+def test_generate_dataset_incremental(tmp_path, rows):
+    path = os.path.join(str(tmp_path), "features.csv")
+    generate_dataset(get_features(str(tmp_path), rows), path)
+    edited = [(1, "The first essay. It has @CAPS1 three sentences, really!", 3)] + rows[1:] + [(2, "A new essay.", 2)]
+    data = generate_dataset(get_features(str(tmp_path), edited), path)
+    with open(path, "r") as f:
+        saved = f.read()
+    f.close()
+    # Compare with a dataset generated from scratch
+    os.remove(path + ".meta.json")
+    assert generate_dataset(get_features(str(tmp_path), edited), path) == data
+    with open(path, "r") as f:
+        assert f.read() == saved
+    f.close()
+
+def test_essay_without_words(tmp_path, rows):
+    features = get_features(str(tmp_path), rows + [(1, "", 0)])
+    features.precompute_corpus_stats()
+    features.split_sentences = lambda text: []
+    blacklist = list(features.pos_features | {"spell_err"})
+    values = features.get_features(len(rows), blacklist_features=blacklist)
+    assert values["words"] == 0 and values["avg_word_len"] == 0 and values["avg_sentence_len"] == 0
+    assert features.average_word_length(len(rows)) == 0
+    keys = [key for key in features.feature_descriptions if not key in blacklist]
+    assert features.feature_matrix([len(rows)], keys).tolist() == [[values[key] for key in keys]]
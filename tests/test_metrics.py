@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from conftest import write_dataset
+from AESData import AESData
+from AESMetrics import AESMetrics, bootstrap_kappa, mean_kappa, quadratic_weighted_kappa
+
+def get_ratings(seed: int, n: int = 200, labels: int = 6) -> tuple:
+    """Random correlated ratings of two raters"""
+    rng = np.random.default_rng(seed)
+    y_true = rng.integers(0, labels, size=n)
+    y_pred = np.clip(y_true + rng.integers(-2, 3, size=n), 0, labels - 1)
+    return y_true, y_pred
+
+@pytest.mark.parametrize("seed", range(5))
+def test_quadratic_weighted_kappa(seed):
+    from sklearn.metrics import cohen_kappa_score
+    y_true, y_pred = get_ratings(seed)
+    assert quadratic_weighted_kappa(y_true, y_pred) == pytest.approx(cohen_kappa_score(y_true, y_pred, weights="quadratic"))
+    labels = list(range(-1, 8))
+    assert quadratic_weighted_kappa(y_true, y_pred, labels) == pytest.approx(cohen_kappa_score(y_true, y_pred, labels=labels, weights="quadratic"))
+
+def test_quadratic_weighted_kappa_ignores_other_labels():
+    y_true, y_pred = get_ratings(0)
+    valid = (y_true < 5) & (y_pred < 5)
+    assert quadratic_weighted_kappa(y_true, y_pred, range(5)) == pytest.approx(quadratic_weighted_kappa(y_true[valid], y_pred[valid], range(5)))
+
+def test_quadratic_weighted_kappa_undefined():
+    assert np.isnan(quadratic_weighted_kappa([2, 2, 2], [2, 2, 2]))
+
+def test_bootstrap_kappa():
+    y_true, y_pred = get_ratings(1, n=50)
+    labels = range(6)
+    kappas = bootstrap_kappa(y_true, y_pred, labels, resamples=100, seed=3)
+    # Resamples are drawn in the same order by a plain loop
+    samples = np.random.default_rng(3).integers(0, len(y_true), size=(100, len(y_true)))
+    expected = [quadratic_weighted_kappa(y_true[rows], y_pred[rows], labels) for rows in samples]
+    np.testing.assert_allclose(kappas, expected)
+    # Chunks do not change the resamples
+    np.testing.assert_allclose(bootstrap_kappa(y_true, y_pred, labels, resamples=100, seed=3, chunk_size=120), kappas)
+
+def test_mean_kappa():
+    assert mean_kappa([0.5, 0.5]) == pytest.approx(0.5)
+    assert mean_kappa([0.2, 0.8], [1, 0]) == pytest.approx(0.2)
+    assert mean_kappa([0.2, 0.8]) == pytest.approx(np.tanh((np.arctanh(0.2) + np.arctanh(0.8)) / 2))
+
+def test_score_scales(tmp_path, rows):
+    data = AESData(write_dataset(str(tmp_path), rows))
+    metrics = AESMetrics(data)
+    prompts = np.array([1, 1, 2, 2, 2])
+    scores = np.array([0, 4, 1, 3, 6])
+    norm = metrics.to_norm(scores, prompts)
+    np.testing.assert_allclose(norm, [0, 1, 0, 0.4, 1])
+    np.testing.assert_array_equal(metrics.to_native(norm, prompts), scores)
+    # Predictions are rounded and clipped to the scale of the prompt
+    np.testing.assert_array_equal(metrics.to_native([-0.3, 1.2, 0.29, 0.31], [1, 1, 2, 2]), [0, 4, 2, 3])
+    assert [data.get_score_norm(id) for id in range(data.count_essays())] == pytest.approx(metrics.to_norm([3, 5, 0, 6], [1, 2, 1, 2]).tolist())
+
+def test_kappa_of_prompts(tmp_path, rows):
+    metrics = AESMetrics(AESData(write_dataset(str(tmp_path), rows)))
+    y_true, y_pred = get_ratings(2, n=100, labels=5)
+    prompts = np.repeat([1, 2], 50)
+    results = metrics.bootstrap(y_true + prompts - 1, y_pred + prompts - 1, prompts, resamples=20, normalized=False)
+    for prompt in [1, 2]:
+        rows = prompts == prompt
+        assert results["prompts"][prompt]["qwk"] == pytest.approx(quadratic_weighted_kappa(y_true[rows], y_pred[rows]))
+        low, high = results["prompts"][prompt]["ci"]
+        assert low <= high
+    assert results["overall"]["qwk"] == pytest.approx(mean_kappa([results["prompts"][1]["qwk"], results["prompts"][2]["qwk"]]))
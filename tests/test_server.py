@@ -0,0 +1,62 @@
+import asyncio
+import os
+import signal
+import socket
+from conftest import write_dataset
+import AESServer
+
+class WordCountScorer:
+    """Scores essays by their number of words. Essays containing "fail" raise an error like a failing feature"""
+
+    def __init__(self, dataset_path: str, regressor_path: str, blacklist_features: list = [], embeddings_model: str = "", total_average_word_length: float = -1):
+        pass
+
+    def score(self, essays: list) -> list:
+        results = []
+        for text, prompt in essays:
+            if "fail" in text:
+                raise ZeroDivisionError("division by zero")
+            results.append({"score": len(text.split())})
+        return results
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def run_requests(server: AESServer.AESServer, port: int, bodies: list) -> list:
+    """Start the server, send requests at the same time and stop the server. Returns status and response of each request"""
+    serving = asyncio.ensure_future(server.serve("127.0.0.1", port))
+    while True:
+        try:
+            await AESServer.request("GET", "/health", port=port)
+            break
+        except ConnectionError:
+            await asyncio.sleep(0.05)
+    responses = await asyncio.gather(*[AESServer.request("POST", "/score", body, port=port) for body in bodies])
+    os.kill(os.getpid(), signal.SIGTERM)
+    await serving
+    return responses
+
+def test_failing_essay_does_not_fail_its_batch(tmp_path, rows, monkeypatch):
+    monkeypatch.setattr(AESServer, "AESScorer", WordCountScorer)
+    config = {"dataset_path": write_dataset(str(tmp_path), rows), "regressor_path": ""}
+    # Requests wait long enough to be scored in one batch
+    server = AESServer.AESServer(config, workers=0, max_batch_size=32, max_wait=0.5)
+    port = get_free_port()
+    bodies = [
+        {"text": "Two words", "prompt": 1},
+        {"text": "This will fail", "prompt": 2},
+        {"essays": [{"text": "One"}, {"text": "Three more words"}]},
+        {"text": ""},
+        {"text": "!!!"},
+        {"text": "Unknown prompt", "prompt": 3}
+    ]
+    responses = asyncio.run(run_requests(server, port, bodies))
+    assert responses[0] == (200, {"results": [{"score": 2}]})
+    assert responses[1] == (500, {"error": "division by zero"})
+    assert responses[2] == (200, {"results": [{"score": 1}, {"score": 3}]})
+    for status, response in responses[3:]:
+        assert status == 400
+    assert server.get_stats()["errors"] == 1
+    assert max(server.batch_sizes) == 4